@@ -1,13 +1,16 @@
 from datetime import datetime, timedelta
 import os
+import time
 from dotenv import load_dotenv
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
-from sqlmodel import select, Session
-from app.db import get_session, UPLOAD_DIR
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.db import get_async_read_session, UPLOAD_DIR
 from app.models import User
+from app.cache import TTLCache
+from app.services.hashing import pwd_context
 
 # Load environment variables
 load_dotenv()
@@ -21,12 +24,15 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(
     os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 10080)  # 7 days default
 )
 
+# Authenticated user cache: token -> decoded claims, username -> User row
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
+token_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
 # Ensure upload folder exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
@@ -46,28 +52,53 @@ def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)
-) -> User:
+def decode_token(token: str) -> dict:
+    """Decode and verify a JWT, reusing the result for repeat tokens."""
+    payload = token_cache.get(token)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Never keep a token cached past its own expiry
+        ttl = min(USER_CACHE_TTL, payload.get("exp", 0) - time.time()) if "exp" in payload else None
+        if ttl is None or ttl > 0:
+            token_cache.set(token, payload, ttl=ttl)
+    return payload
+
+
+def invalidate_user(username: str):
+    """Drop a cached user row after its profile, balance or admin flag changed."""
+    user_cache.pop(username)
+
+
+async def user_from_token(token: str, session: AsyncSession) -> User:
+    """Resolve a bearer token to its (cached) user row, or raise 401."""
     exc = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         username: str | None = payload.get("sub")
         if not username:
             raise exc
     except JWTError:
         raise exc
 
-    user = session.exec(select(User).where(User.username == username)).first()
-    if not user:
-        raise exc
+    user = user_cache.get(username)
+    if user is None:
+        user = (await session.exec(select(User).where(User.username == username))).first()
+        if not user:
+            raise exc
+        user_cache.set(username, user)
     return user
 
 
+async def get_current_user(
+    token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_async_read_session)
+) -> User:
+    return await user_from_token(token, session)
+
+
 async def get_admin_user(current_user: User = Depends(get_current_user)) -> User:
     if not current_user.is_admin:
         raise HTTPException(
@@ -1,8 +1,9 @@
 import os
 from dotenv import load_dotenv
 from sqlmodel import SQLModel, create_engine, Session
-from fastapi.staticfiles import StaticFiles
-from fastapi import FastAPI
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
 
 load_dotenv()
 
@@ -10,17 +11,105 @@ load_dotenv()
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./bazario.db")
 engine = create_engine(DATABASE_URL, echo=False)
 
+# Opt-in production profile for SQLite (SQLITE_PROFILE=production)
+SQLITE_PROFILE = os.environ.get("SQLITE_PROFILE", "default")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", 64 * 1024))
+SQLITE_PRODUCTION = DATABASE_URL.startswith("sqlite") and SQLITE_PROFILE == "production"
+
+
+def to_async_url(url: str) -> str:
+    """Map a sync driver URL to its async counterpart (sqlite -> aiosqlite)."""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:") or url.startswith("postgres:"):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    if url.startswith("mysql:"):
+        return url.replace("mysql:", "mysql+aiomysql:", 1)
+    return url
+
+
+# Async engine (any async driver can be set explicitly via ASYNC_DATABASE_URL)
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 20))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=False,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=True,
+)
+
+
+def apply_sqlite_pragmas(dbapi_connection, read_only: bool = False):
+    """Set the production pragmas on a fresh SQLite connection."""
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        # WAL is persistent in the file; only writers need to switch it on
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def _on_connect(read_only: bool):
+    def listener(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, read_only=read_only)
+    return listener
+
+
+# Read-only pools: GET handlers use these so catalog reads never queue behind
+# writers. Outside the production profile they are the regular engines.
+if SQLITE_PRODUCTION:
+    read_engine = create_engine(DATABASE_URL, echo=False)
+    async_read_engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        echo=False,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_pre_ping=True,
+    )
+    event.listen(engine, "connect", _on_connect(read_only=False))
+    event.listen(async_engine.sync_engine, "connect", _on_connect(read_only=False))
+    event.listen(read_engine, "connect", _on_connect(read_only=True))
+    event.listen(async_read_engine.sync_engine, "connect", _on_connect(read_only=True))
+else:
+    read_engine = engine
+    async_read_engine = async_engine
+
 # Upload directory for images
 UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "./uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)  # Ensure folder exists
 
-# FastAPI app (used for mounting static files)
-app = FastAPI(title="Bazario API")
-
-# Serve uploads folder as static files so Flutter can access them
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
-
 # Database session generator
 def get_session():
     with Session(engine) as session:
         yield session
+
+
+# Async session generator (objects stay usable after commit)
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+# Read-only session generators for GET handlers
+def get_read_session():
+    with Session(read_engine) as session:
+        yield session
+
+
+async def get_async_read_session():
+    async with AsyncSession(async_read_engine, expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,66 @@
+"""Great-circle helpers for the location features."""
+import math
+from typing import List, Tuple
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points, in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(lat: float, lon: float, radius_km: float) -> List[Tuple[float, float, float, float]]:
+    """``(min_lat, max_lat, min_lon, max_lon)`` boxes covering the circle.
+
+    Usually one box; two when the circle crosses the antimeridian. Every point
+    within ``radius_km`` lies in a box, the corners still need a distance check.
+    """
+    angular = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        # Reaches a pole: every longitude is in range
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+
+    dlon = math.degrees(math.asin(math.sin(angular) / math.cos(math.radians(lat))))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
+
+
+def unit_vectors(lat, lon) -> np.ndarray:
+    """Points as unit vectors on the sphere, shape ``(n, 3)``."""
+    phi, lmb = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    cos_phi = np.cos(phi)
+    return np.stack([cos_phi * np.cos(lmb), cos_phi * np.sin(lmb), np.sin(phi)], axis=1)
+
+
+def nearest(from_lat, from_lon, to_lat, to_lon, chunk: int = 2048) -> Tuple[np.ndarray, np.ndarray]:
+    """For every ``from`` point, the index of and distance (km) to the nearest ``to`` point.
+
+    Haversine is ``hav = (1 - u.v) / 2`` for unit vectors ``u``, ``v``, so the
+    full distance matrix is a matrix product and the nearest point is its row
+    argmax. Rows are processed ``chunk`` at a time to bound memory; only the
+    winners go through the trigonometric distance formula.
+    """
+    origins = unit_vectors(from_lat, from_lon)
+    targets = unit_vectors(to_lat, to_lon).T.copy()
+    index = np.empty(len(origins), dtype=np.intp)
+    for start in range(0, len(origins), chunk):
+        index[start:start + chunk] = np.argmax(origins[start:start + chunk] @ targets, axis=1)
+
+    lat1, lon1 = np.radians(np.asarray(from_lat, dtype=np.float64)), np.radians(np.asarray(from_lon, dtype=np.float64))
+    lat2 = np.radians(np.asarray(to_lat, dtype=np.float64))[index]
+    lon2 = np.radians(np.asarray(to_lon, dtype=np.float64))[index]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+    return index, distance
@@ -0,0 +1,114 @@
+"""``Idempotency-Key`` support for retry-prone POSTs.
+
+The first request with a given key runs normally and its response is stored
+in the shared KV store under ``(user, endpoint, key)`` for
+``IDEMPOTENCY_TTL`` seconds. Repeats get that response back (with
+``Idempotent-Replayed: true``) without reaching the handler; a repeat that
+arrives while the first is still running waits for it, up to
+``IDEMPOTENCY_WAIT`` seconds, then gets a 409. 5xx responses are not stored,
+so those can be retried for real.
+"""
+import asyncio
+import base64
+import json
+import os
+from jose import JWTError
+from starlette.concurrency import run_in_threadpool
+from app.auth import decode_token
+from app.services.kv import kv
+
+IDEMPOTENT_ROUTES = {("POST", "/orders/"), ("POST", "/coins/request")}
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_LOCK_TTL = float(os.environ.get("IDEMPOTENCY_LOCK_TTL", 60))  # frees keys of crashed requests
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", 10))
+MAX_KEY_LENGTH = 255
+
+
+def _header(scope, name: bytes):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _user(scope):
+    scheme, _, token = (_header(scope, b"authorization") or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return decode_token(token).get("sub")
+    except JWTError:
+        return None
+
+
+async def _send_json(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in IDEMPOTENT_ROUTES:
+            return await self.app(scope, receive, send)
+        key = _header(scope, b"idempotency-key")
+        user = _user(scope) if key else None
+        if not user:
+            # No key, or unauthenticated (the handler will answer 401)
+            return await self.app(scope, receive, send)
+        if len(key) > MAX_KEY_LENGTH:
+            return await _send_json(send, 400, f"Idempotency-Key longer than {MAX_KEY_LENGTH} characters")
+
+        record_key = f"idem:{user}:{scope['path']}:{key}"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + IDEMPOTENCY_WAIT
+        delay = 0.05
+        while not await run_in_threadpool(kv.add, record_key, {"state": "pending"}, IDEMPOTENCY_LOCK_TTL):
+            record = await run_in_threadpool(kv.get, record_key)
+            if record is None:
+                continue  # the first attempt failed or expired; take over
+            if record["state"] == "done":
+                return await self._replay(record, send)
+            if loop.time() >= deadline:
+                return await _send_json(send, 409, "A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+        await self._run_and_store(record_key, scope, receive, send)
+
+    async def _run_and_store(self, record_key, scope, receive, send):
+        response = {"status": 500, "headers": [], "body": b""}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[k.decode("latin-1"), v.decode("latin-1")] for k, v in message["headers"]]
+            elif message["type"] == "http.response.body":
+                response["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException:
+            await run_in_threadpool(kv.delete, record_key)
+            raise
+        if response["status"] >= 500:
+            await run_in_threadpool(kv.delete, record_key)
+            return
+        await run_in_threadpool(kv.set, record_key, {
+            "state": "done",
+            "status": response["status"],
+            "headers": response["headers"],
+            "body": base64.b64encode(response["body"]).decode(),
+        }, IDEMPOTENCY_TTL)
+
+    @staticmethod
+    async def _replay(record, send):
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in record["headers"]]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": base64.b64decode(record["body"])})
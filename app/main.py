@@ -1,18 +1,23 @@
 from fastapi import FastAPI
 from sqlmodel import SQLModel, Session, select
-from app.db import get_session, engine, UPLOAD_DIR
+from app.db import get_session, engine, async_engine, UPLOAD_DIR
 from app.models import User
 from app.auth import get_password_hash
-from app.routes import users, stores, products, orders, coins, cart, location
+from app.routes import users, stores, products, orders, coins, cart, location, uploads, inbox, events
 import app.services.notifications as notifications
+import app.services.hashing as hashing
+from app.services.push import dispatcher
+from app.services.events import broker
+from app.services.ledger import run_snapshots
+from app.migrate import run_migrations
+from app.idempotency import IdempotencyMiddleware
+import asyncio
 import os
-from fastapi.staticfiles import StaticFiles
 
 
 
 app = FastAPI(title="Bazario Backend")
-
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.add_middleware(IdempotencyMiddleware)
 
 
 # Include routers
@@ -24,10 +29,17 @@ app.include_router(coins.router)
 app.include_router(cart.router)
 app.include_router(location.router)
 app.include_router(notifications.router)
+app.include_router(inbox.router)
+app.include_router(events.router)
+app.include_router(uploads.router)
 
 @app.on_event("startup")
 async def on_startup():
     SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
+    await dispatcher.start()
+    broker.start()
+    app.state.snapshot_task = asyncio.create_task(run_snapshots())
     os.makedirs(UPLOAD_DIR, exist_ok=True)  # Ensure upload dir exists
     with next(get_session()) as session:
         admin = session.exec(select(User).where(User.username == "meadminBoss")).first()
@@ -43,6 +55,13 @@ async def on_startup():
             session.commit()
             print("✅ Admin user created: meadminBoss / MuslimbekMalika32@")
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.snapshot_task.cancel()
+    hashing.shutdown()
+    await dispatcher.stop()
+    await async_engine.dispose()
+
 @app.get("/")
 def root():
     return {"message": "Welcome to Bazario Backend API"}
@@ -1 +1,249 @@
+"""Versioned, in-place schema migrations.
 
+Run automatically from ``main.on_startup`` after ``create_all`` or by hand with
+``python -m app.migrate``. Applied versions are recorded in ``schema_migrations``.
+Every step is idempotent (``IF NOT EXISTS`` / column checks), so a migration
+that was half-applied or raced by another worker can simply be re-run.
+"""
+from datetime import datetime
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from app.db import engine
+from app.services.storage import migrate_legacy_rows
+from app.services.ledger import record_opening_balances
+
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """Register a migration step. Versions are applied in ascending order."""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+# -----------------------------
+# Helpers
+# -----------------------------
+def add_column(conn, table: str, column: str, ddl: str):
+    """ALTER TABLE ... ADD COLUMN unless the column already exists."""
+    existing = {c["name"] for c in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+
+
+def create_index(conn, name: str, table: str, columns: list, unique: bool = False):
+    cols = ", ".join(columns)
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(f'CREATE {kind} IF NOT EXISTS {name} ON "{table}" ({cols})'))
+
+
+# -----------------------------
+# Migrations
+# -----------------------------
+@migration(1, "lookup indexes, unique username, missing store/order columns")
+def _lookup_indexes(conn):
+    add_column(conn, "store", "store_photo", "VARCHAR")
+    add_column(conn, "order", "address", "VARCHAR")
+
+    duplicates = conn.execute(text(
+        'SELECT username FROM "user" GROUP BY username HAVING COUNT(*) > 1'
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(f"Cannot make username unique, duplicates: {duplicates}")
+
+    create_index(conn, "ix_user_username", "user", ["username"], unique=True)
+    create_index(conn, "ix_order_user_id", "order", ["user_id"])
+    create_index(conn, "ix_coinrequest_user_id", "coinrequest", ["user_id"])
+    create_index(conn, "ix_notification_user_id", "notification", ["user_id"])
+    create_index(conn, "ix_cartitem_user_id", "cartitem", ["user_id"])
+    create_index(conn, "ix_product_store_id", "product", ["store_id"])
+
+
+@migration(2, "user.created_at and (created_at, id) keyset indexes")
+def _keyset_indexes(conn):
+    add_column(conn, "user", "created_at", "DATETIME")
+    # Same text format SQLAlchemy writes, so keyset comparisons stay consistent
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+    conn.execute(text('UPDATE "user" SET created_at = :now WHERE created_at IS NULL'), {"now": now})
+
+    create_index(conn, "ix_user_created_at_id", "user", ["created_at", "id"])
+    create_index(conn, "ix_product_created_at_id", "product", ["created_at", "id"])
+    create_index(conn, "ix_product_store_id_created_at_id", "product", ["store_id", "created_at", "id"])
+    create_index(conn, "ix_order_created_at_id", "order", ["created_at", "id"])
+    create_index(conn, "ix_order_user_id_created_at_id", "order", ["user_id", "created_at", "id"])
+    create_index(conn, "ix_coinrequest_created_at_id", "coinrequest", ["created_at", "id"])
+    create_index(conn, "ix_coinrequest_user_id_created_at_id", "coinrequest", ["user_id", "created_at", "id"])
+
+
+PRODUCT_FTS_COLUMNS = [
+    "title_in_uzb", "description_in_uzb",
+    "title_in_rus", "description_in_rus",
+    "title_in_eng", "description_in_eng",
+]
+
+
+@migration(3, "product_fts full-text index kept in sync by triggers")
+def _product_fts(conn):
+    if conn.dialect.name != "sqlite":
+        return  # FTS5 is SQLite only; search is unavailable on other backends
+    cols = ", ".join(PRODUCT_FTS_COLUMNS)
+    new = ", ".join(f"new.{c}" for c in PRODUCT_FTS_COLUMNS)
+    old = ", ".join(f"old.{c}" for c in PRODUCT_FTS_COLUMNS)
+
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5({cols}, "
+        "content='product', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN "
+        f"INSERT INTO product_fts(rowid, {cols}) VALUES (new.id, {new}); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN "
+        f"INSERT INTO product_fts(product_fts, rowid, {cols}) VALUES ('delete', old.id, {old}); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE ON product BEGIN "
+        f"INSERT INTO product_fts(product_fts, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO product_fts(rowid, {cols}) VALUES (new.id, {new}); END"
+    ))
+    # Index the rows that already exist
+    conn.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+
+
+@migration(4, "move flat uploads to content-addressed blobs")
+def _content_addressed_uploads(conn):
+    # Legacy files stay in place until `python -m app.services.storage --prune-legacy`
+    updated = migrate_legacy_rows(conn)
+    print(f"📦 Pointed {updated} image paths at content-addressed blobs")
+
+
+@migration(5, "user.unread_notifications counter and inbox indexes")
+def _unread_counter(conn):
+    add_column(conn, "user", "unread_notifications", "INTEGER NOT NULL DEFAULT 0")
+    create_index(conn, "ix_notification_user_id_read_created_at", "notification", ["user_id", "read", "created_at"])
+    create_index(conn, "ix_notification_user_id_created_at_id", "notification", ["user_id", "created_at", "id"])
+    if conn.dialect.name != "sqlite":
+        return  # the counter triggers below use SQLite syntax
+
+    # Keep the counter exact on every write path, including bulk inserts
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS notification_unread_ai AFTER INSERT ON notification "
+        "WHEN NOT new.read BEGIN "
+        'UPDATE "user" SET unread_notifications = unread_notifications + 1 WHERE id = new.user_id; END'
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS notification_unread_ad AFTER DELETE ON notification "
+        "WHEN NOT old.read BEGIN "
+        'UPDATE "user" SET unread_notifications = unread_notifications - 1 WHERE id = old.user_id; END'
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS notification_unread_au AFTER UPDATE OF read, user_id ON notification "
+        "WHEN old.read IS NOT new.read OR old.user_id IS NOT new.user_id BEGIN "
+        'UPDATE "user" SET unread_notifications = unread_notifications - (NOT old.read) WHERE id = old.user_id; '
+        'UPDATE "user" SET unread_notifications = unread_notifications + (NOT new.read) WHERE id = new.user_id; END'
+    ))
+    # Count what is already there
+    conn.execute(text(
+        'UPDATE "user" SET unread_notifications = ('
+        "SELECT COUNT(*) FROM notification WHERE notification.user_id = \"user\".id AND NOT notification.read)"
+    ))
+
+
+@migration(6, "one cartitem row per (user_id, product_id)")
+def _cart_upsert_key(conn):
+    # Fold duplicate lines into the newest one before adding the unique key
+    conn.execute(text(
+        "UPDATE cartitem SET quantity = ("
+        "SELECT SUM(c.quantity) FROM cartitem c "
+        "WHERE c.user_id = cartitem.user_id AND c.product_id = cartitem.product_id) "
+        "WHERE id IN (SELECT MAX(id) FROM cartitem GROUP BY user_id, product_id HAVING COUNT(*) > 1)"
+    ))
+    conn.execute(text(
+        "DELETE FROM cartitem WHERE id NOT IN (SELECT MAX(id) FROM cartitem GROUP BY user_id, product_id)"
+    ))
+    create_index(conn, "ix_cartitem_user_id_product_id", "cartitem", ["user_id", "product_id"], unique=True)
+
+
+@migration(7, "store_rtree spatial index kept in sync by triggers")
+def _store_rtree(conn):
+    if conn.dialect.name != "sqlite":
+        return  # R*Tree is SQLite only; /stores/nearby falls back to a range scan
+    has_point = "new.latitude IS NOT NULL AND new.longitude IS NOT NULL"
+    point = "new.id, new.latitude, new.latitude, new.longitude, new.longitude"
+
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS store_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS store_rtree_ai AFTER INSERT ON store WHEN {has_point} BEGIN "
+        f"INSERT INTO store_rtree VALUES ({point}); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS store_rtree_ad AFTER DELETE ON store BEGIN "
+        "DELETE FROM store_rtree WHERE id = old.id; END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS store_rtree_au AFTER UPDATE OF latitude, longitude ON store BEGIN "
+        "DELETE FROM store_rtree WHERE id = old.id; "
+        f"INSERT INTO store_rtree SELECT {point} WHERE {has_point}; END"
+    ))
+    # Index the stores that already exist
+    conn.execute(text(
+        "INSERT OR REPLACE INTO store_rtree "
+        "SELECT id, latitude, latitude, longitude, longitude FROM store "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+    ))
+
+
+@migration(8, "coin ledger opening balances")
+def _coin_ledger(conn):
+    # Tables come from create_all; seed them so ledger sums match User.coins
+    print(f"🪙 Recorded {record_opening_balances(conn)} opening balances")
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+def applied_versions(conn) -> set:
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at DATETIME NOT NULL)"
+    ))
+    return set(conn.execute(text("SELECT version FROM schema_migrations")).scalars().all())
+
+
+def run_migrations(bind=engine) -> list:
+    """Apply every pending migration, each in its own transaction."""
+    with bind.begin() as conn:
+        done = applied_versions(conn)
+
+    applied = []
+    for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in done:
+            continue
+        try:
+            with bind.begin() as conn:
+                fn(conn)
+                conn.execute(
+                    text("INSERT INTO schema_migrations (version, description, applied_at) "
+                         "VALUES (:v, :d, :t)"),
+                    {"v": version, "d": description, "t": datetime.utcnow()},
+                )
+        except IntegrityError:
+            # Another worker recorded this version first
+            continue
+        applied.append(version)
+        print(f"🛠️ Applied migration {version}: {description}")
+    return applied
+
+
+if __name__ == "__main__":
+    from sqlmodel import SQLModel
+    import app.models  # noqa: F401  (register tables)
+
+    SQLModel.metadata.create_all(engine)
+    run_migrations(engine)
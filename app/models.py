@@ -1,10 +1,13 @@
 from datetime import datetime
 from typing import Dict, Optional, List
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, JSON, Column
 
 class User(SQLModel, table=True):
+    __table_args__ = (Index("ix_user_created_at_id", "created_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    username: str
+    username: str = Field(index=True, unique=True)
     full_name: Optional[str] = None
     email: Optional[str] = None
     phone_number: Optional[str] = None
@@ -12,6 +15,8 @@ class User(SQLModel, table=True):
     is_admin: bool = False
     coins: int = 0    
     language : int = 0  # 0 - Uzbek, 1 - Russian, 2 - English
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    unread_notifications: int = 0  # maintained by triggers on notification (migration 5)
     
 class LocationRequest(SQLModel):
     user_id: str
@@ -28,6 +33,11 @@ class Store(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Product(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_product_created_at_id", "created_at", "id"),
+        Index("ix_product_store_id_created_at_id", "store_id", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     title_in_uzb: str
     description_in_uzb: Optional[str] = None
@@ -37,12 +47,17 @@ class Product(SQLModel, table=True):
     description_in_eng: Optional[str] = None
     price: int
     image_path: Optional[str] = None
-    store_id: int = Field(foreign_key="store.id")
+    store_id: int = Field(foreign_key="store.id", index=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class CoinRequest(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_coinrequest_created_at_id", "created_at", "id"),
+        Index("ix_coinrequest_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int
+    user_id: int = Field(index=True)
     amount: int
     image_path: Optional[str] = None  # Transaction picture
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -52,16 +67,26 @@ class CoinRequest(SQLModel, table=True):
     reviewer_id: Optional[int] = None
 
 class Notification(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_notification_user_id_read_created_at", "user_id", "read", "created_at"),
+        Index("ix_notification_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int
+    user_id: int = Field(index=True)
     title: str
     message: str
     read: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Order(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_order_created_at_id", "created_at", "id"),
+        Index("ix_order_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int
+    user_id: int = Field(index=True)
     products: List[dict] = Field(default_factory=list, sa_column=Column(JSON))
     total_coins: int
     total_price: Optional[int] = None  # make it optional
@@ -69,14 +94,38 @@ class Order(SQLModel, table=True):
     delivery_time: int | None = None  # in minutes
     name: Optional[str] = None
     phone_number: Optional[str] = None
+    address: Optional[str] = None
     latitude: Optional[float] = None
     longitude: Optional[float] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     
 class CartItem(SQLModel, table=True):
+    __table_args__ = (Index("ix_cartitem_user_id_product_id", "user_id", "product_id", unique=True),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int
+    user_id: int = Field(index=True)
     product_id: int
     quantity: int = 1
-    added_at: datetime = Field(default_factory=datetime.utcnow)
\ No newline at end of file
+    added_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CoinLedger(SQLModel, table=True):
+    """Append-only record of every balance change; SUM(amount) per user == User.coins."""
+    __table_args__ = (Index("ix_coinledger_user_id_created_at_id", "user_id", "created_at", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(index=True)
+    amount: int  # signed: credits > 0, debits < 0
+    reason: str  # "opening", "coin_request", "order", "order_payment"
+    ref_id: Optional[int] = None  # coin request / order id
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CoinBalanceSnapshot(SQLModel, table=True):
+    """User balance after ledger entry ``ledger_id``, so history sums start from here."""
+    __table_args__ = (Index("ix_coinbalancesnapshot_user_id_ledger_id", "user_id", "ledger_id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int
+    ledger_id: int
+    balance: int
+    as_of: datetime  # created_at of ledger entry ``ledger_id``
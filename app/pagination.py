@@ -0,0 +1,76 @@
+"""Keyset (cursor) pagination shared by the list endpoints.
+
+Rows are ordered newest first by ``(created_at, id)``. The cursor of the last
+row on a page is returned in the ``X-Next-Cursor`` header and passed back as
+``?after=`` to fetch the next page, so every page costs one index range scan
+no matter how deep the client has paged.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+class Page:
+    """Query parameters for a cursor page: ``?limit=&after=``."""
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        after: Optional[str] = None,
+    ):
+        self.limit = limit
+        self.after = decode_cursor(after) if after else None
+
+
+def keyset(query, model, page: Page):
+    """Restrict ``query`` to the rows after the cursor, newest first.
+
+    One extra row is fetched so ``next_page`` can tell whether another page exists.
+    """
+    created_at, row_id = model.created_at, model.id
+    if page.after:
+        after_created, after_id = page.after
+        query = query.where(or_(
+            created_at < after_created,
+            and_(created_at == after_created, row_id < after_id),
+        ))
+    return query.order_by(created_at.desc(), row_id.desc()).limit(page.limit + 1)
+
+
+def split_page(rows, page: Page):
+    """Trim the look-ahead row; returns ``(rows, next_cursor or None)``."""
+    rows = list(rows)
+    if len(rows) <= page.limit:
+        return rows, None
+    rows = rows[:page.limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
+
+
+def next_page(rows, page: Page, response: Response) -> list:
+    """Trim the look-ahead row and publish the next cursor, if any."""
+    rows, cursor = split_page(rows, page)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return rows
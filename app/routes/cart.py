@@ -1,84 +1,124 @@
 # cart.py
+from datetime import datetime
 from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel
-from typing import List
-from uuid import uuid4
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select, Session
+from app.db import get_session, get_read_session
+from app.models import CartItem, Product, User
+from app.auth import get_current_user
+from app.utils import PRODUCT_LANGUAGE_COLUMNS
 
 router = APIRouter(prefix="/cart", tags=["Cart"])
 
-# In-memory cart storage (replace with DB in production)
-CART_DB = {}
-
 # Pydantic models
-class CartItem(BaseModel):
+class CartLine(BaseModel):
     product_id: int
     name: str
     price: float
     amount: int
 
 class CartResponse(BaseModel):
-    items: List[CartItem]
+    items: List[CartLine]
     total_price: float
 
 class AddToCartRequest(BaseModel):
     product_id: int
-    name: str
-    price: float
-    amount: int
+    amount: int = Field(1, ge=1)
+    # Ignored: name and price always come from the product row
+    name: Optional[str] = None
+    price: Optional[float] = None
 
 class UpdateCartRequest(BaseModel):
     product_id: int
-    amount: int
-
-
-def calculate_total(items: List[CartItem]):
-    return sum(item.price * item.amount for item in items)
+    amount: int = Field(ge=0)  # 0 removes the line
+
+
+def load_cart(session: Session, user: User) -> CartResponse:
+    """The user's cart joined with current product prices, total included (one query)."""
+    title, _ = PRODUCT_LANGUAGE_COLUMNS.get(user.language, PRODUCT_LANGUAGE_COLUMNS[2])
+    rows = session.exec(
+        select(
+            CartItem.product_id,
+            title.label("name"),
+            Product.price,
+            CartItem.quantity,
+            func.sum(Product.price * CartItem.quantity).over().label("total"),
+        )
+        .join(Product, Product.id == CartItem.product_id)
+        .where(CartItem.user_id == user.id)
+        .order_by(CartItem.added_at, CartItem.id)
+    ).all()
+    items = [
+        CartLine(product_id=row.product_id, name=row.name, price=row.price, amount=row.quantity)
+        for row in rows
+    ]
+    return CartResponse(items=items, total_price=rows[0].total if rows else 0)
 
 
 # Routes
 @router.get("/", response_model=CartResponse)
-def get_cart(user_id: str = "default_user"):
-    cart_items = CART_DB.get(user_id, [])
-    return CartResponse(items=cart_items, total_price=calculate_total(cart_items))
+def get_cart(session: Session = Depends(get_read_session), current_user: User = Depends(get_current_user)):
+    return load_cart(session, current_user)
 
 
 @router.post("/add", response_model=CartResponse)
-def add_to_cart(data: AddToCartRequest, user_id: str = "default_user"):
-    cart_items = CART_DB.get(user_id, [])
-    
-    # Check if product already exists
-    for item in cart_items:
-        if item.product_id == data.product_id:
-            item.amount += data.amount
-            CART_DB[user_id] = cart_items
-            return CartResponse(items=cart_items, total_price=calculate_total(cart_items))
-    
-    # Add new product
-    cart_items.append(CartItem(**data.dict()))
-    CART_DB[user_id] = cart_items
-    return CartResponse(items=cart_items, total_price=calculate_total(cart_items))
+def add_to_cart(
+    data: AddToCartRequest,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    if not session.exec(select(Product.id).where(Product.id == data.product_id)).first():
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    # Insert the line or add to its quantity, atomically
+    stmt = sqlite_insert(CartItem).values(
+        user_id=current_user.id,
+        product_id=data.product_id,
+        quantity=data.amount,
+        added_at=datetime.utcnow(),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "product_id"],
+        set_={"quantity": CartItem.quantity + stmt.excluded.quantity},
+    )
+    session.execute(stmt)
+    session.commit()
+    return load_cart(session, current_user)
 
 
 @router.post("/update", response_model=CartResponse)
-def update_cart(data: UpdateCartRequest, user_id: str = "default_user"):
-    cart_items = CART_DB.get(user_id, [])
-    for item in cart_items:
-        if item.product_id == data.product_id:
-            item.amount = data.amount
-            CART_DB[user_id] = cart_items
-            return CartResponse(items=cart_items, total_price=calculate_total(cart_items))
-    raise HTTPException(status_code=404, detail="Product not in cart")
+def update_cart(
+    data: UpdateCartRequest,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    line = (CartItem.user_id == current_user.id, CartItem.product_id == data.product_id)
+    if data.amount == 0:
+        result = session.execute(delete(CartItem).where(*line))
+    else:
+        result = session.execute(update(CartItem).where(*line).values(quantity=data.amount))
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Product not in cart")
+    session.commit()
+    return load_cart(session, current_user)
 
 
 @router.delete("/remove/{product_id}", response_model=CartResponse)
-def remove_from_cart(product_id: int, user_id: str = "default_user"):
-    cart_items = CART_DB.get(user_id, [])
-    cart_items = [item for item in cart_items if item.product_id != product_id]
-    CART_DB[user_id] = cart_items
-    return CartResponse(items=cart_items, total_price=calculate_total(cart_items))
+def remove_from_cart(
+    product_id: int,
+    session: Session = Depends(get_session),
+    current_user: User = Depends(get_current_user),
+):
+    session.execute(delete(CartItem).where(CartItem.user_id == current_user.id, CartItem.product_id == product_id))
+    session.commit()
+    return load_cart(session, current_user)
 
 
 @router.delete("/clear", response_model=CartResponse)
-def clear_cart(user_id: str = "default_user"):
-    CART_DB[user_id] = []
+def clear_cart(session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+    session.execute(delete(CartItem).where(CartItem.user_id == current_user.id))
+    session.commit()
     return CartResponse(items=[], total_price=0.0)
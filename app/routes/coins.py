@@ -1,12 +1,19 @@
-from typing import List
-from fastapi import APIRouter, Depends, Form, File, UploadFile, HTTPException, Request
+from typing import List, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, Form, File, UploadFile, HTTPException, Request, Response
+from sqlalchemy import update
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime
-from app.db import get_session, UPLOAD_DIR
-from app.models import CoinRequest, User, Notification
-from app.schemas import CoinRequestOut
-from app.auth import get_current_user, get_admin_user
+from app.db import get_session, get_read_session, get_async_read_session, UPLOAD_DIR
+from app.models import CoinRequest, CoinLedger, User, Notification
+from app.schemas import CoinRequestOut, CoinLedgerOut
+from app.auth import get_current_user, get_admin_user, invalidate_user
 from app.utils import save_upload_uploadfile
+from app.pagination import Page, keyset, next_page
+from app.services.images import build_derivatives_safe, variant_urls
+from app.services.storage import public_url
+from app.services.events import broker
+import app.services.ledger as ledger
 
 router = APIRouter(prefix="/coins", tags=["coins"])
 
@@ -15,6 +22,7 @@ router = APIRouter(prefix="/coins", tags=["coins"])
 @router.post("/request")
 def request_coins(
     request: Request,
+    background_tasks: BackgroundTasks,
     amount: int = Form(...),
     transaction_image: UploadFile = File(...),
     session: Session = Depends(get_session),
@@ -32,15 +40,12 @@ def request_coins(
 
         # Save uploaded image safely
         try:
-            image_filename = save_upload_uploadfile(transaction_image, UPLOAD_DIR)
+            image_path = save_upload_uploadfile(transaction_image)
+        except HTTPException:
+            raise
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to save upload: {e}")
 
-        # Normalize image path
-        image_path = image_filename.replace("\\", "/")
-        if not image_path.startswith("uploads/"):
-            image_path = f"uploads/{image_path.split('uploads/')[-1]}"
-
         # Save coin request in DB
         req = CoinRequest(
             user_id=current_user.id,
@@ -50,6 +55,7 @@ def request_coins(
         session.add(req)
         session.commit()
         session.refresh(req)
+        background_tasks.add_task(build_derivatives_safe, image_path)
 
         # Notify all admins
         admins = session.exec(select(User).where(User.is_admin == True)).all()
@@ -65,7 +71,7 @@ def request_coins(
         session.commit()
 
         # Return full image URL
-        image_url = str(request.base_url) + image_path
+        image_url = public_url(image_path, str(request.base_url))
 
         return {
             "request_id": req.id,
@@ -73,6 +79,8 @@ def request_coins(
             "image_url": image_url,
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -80,9 +88,11 @@ def request_coins(
 
 
 @router.get("/requests")
-def list_coin_requests(
+async def list_coin_requests(
     request: Request,
-    session: Session = Depends(get_session),
+    response: Response,
+    page: Page = Depends(),
+    session: AsyncSession = Depends(get_async_read_session),
     current_user=Depends(get_current_user),
 ):
     """List all coin requests (admins see all, users see their own)."""
@@ -91,21 +101,17 @@ def list_coin_requests(
     else:
         query = select(CoinRequest).where(CoinRequest.user_id == current_user.id)
 
-    results = session.exec(query).all()
+    results = next_page((await session.exec(keyset(query, CoinRequest, page))).all(), page, response)
     output = []
 
+    base_url = str(request.base_url)
     for r in results:
-        image_path = r.image_path.replace("\\", "/").replace("./", "")
-        if image_path.startswith("uploads/uploads/"):
-            image_path = image_path.replace("uploads/uploads/", "uploads/")
-        elif not image_path.startswith("uploads/"):
-            image_path = f"uploads/{image_path}"
-
         output.append({
             "id": r.id,
             "user_id": r.user_id,
             "amount": r.amount,
-            "image_url": str(request.base_url) + image_path,
+            "image_url": public_url(r.image_path, base_url) if r.image_path else None,
+            "image_variants": variant_urls(r.image_path, base_url) if r.image_path else {},
             "created_at": r.created_at,
             "reviewed": r.reviewed,
             "approved": r.approved,
@@ -116,7 +122,7 @@ def list_coin_requests(
 @router.get("/requests/{user_id}", response_model=List[CoinRequestOut])
 def get_user_coin_requests(
     user_id: int,
-    session: Session = Depends(get_session),
+    session: Session = Depends(get_read_session),
 ):
     requests = session.exec(
         select(CoinRequest).where(CoinRequest.user_id == user_id)
@@ -124,6 +130,63 @@ def get_user_coin_requests(
     return requests
 
 
+# -----------------------------
+# LEDGER
+# -----------------------------
+def ledger_user_id(current_user: User, user_id: Optional[int]) -> int:
+    """Users see their own ledger; admins may ask for anyone's."""
+    if user_id is None or user_id == current_user.id:
+        return current_user.id
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    return user_id
+
+
+@router.get("/ledger", response_model=List[CoinLedgerOut])
+def list_ledger(
+    response: Response,
+    user_id: Optional[int] = None,
+    page: Page = Depends(),
+    session: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user),
+):
+    query = select(CoinLedger).where(CoinLedger.user_id == ledger_user_id(current_user, user_id))
+    return next_page(session.exec(keyset(query, CoinLedger, page)).all(), page, response)
+
+
+@router.get("/balance_at")
+def get_balance_at(
+    at: datetime,
+    user_id: Optional[int] = None,
+    session: Session = Depends(get_read_session),
+    current_user: User = Depends(get_current_user),
+):
+    user_id = ledger_user_id(current_user, user_id)
+    return {"user_id": user_id, "at": at, "balance": ledger.balance_at(session, user_id, at)}
+
+
+@router.get("/ledger/drift")
+def ledger_drift(admin=Depends(get_admin_user)):
+    """Users whose balance doesn't match their ledger; empty when all is well."""
+    return ledger.drift()
+
+
+def claim_review(session: Session, req_id: int, admin: User, approved: bool) -> CoinRequest:
+    """Mark a request reviewed unless someone already did; the first write of the transaction."""
+    claimed = session.execute(
+        update(CoinRequest)
+        .where(CoinRequest.id == req_id, CoinRequest.reviewed == False)
+        .values(reviewed=True, approved=approved, reviewed_at=datetime.utcnow(), reviewer_id=admin.id)
+    ).rowcount
+    req = session.get(CoinRequest, req_id)
+    if not claimed:
+        session.rollback()
+        if not req:
+            raise HTTPException(status_code=404, detail="Request not found")
+        raise HTTPException(status_code=400, detail="Already reviewed")
+    return req
+
+
 @router.post("/requests/{req_id}/approve")
 def approve_coin_request(
     req_id: int,
@@ -131,28 +194,28 @@ def approve_coin_request(
     admin=Depends(get_admin_user),
 ):
     """Admin approves a coin request."""
-    req = session.get(CoinRequest, req_id)
-    if not req:
-        raise HTTPException(status_code=404, detail="Request not found")
-    if req.reviewed:
-        raise HTTPException(status_code=400, detail="Already reviewed")
-
-    req.reviewed = True
-    req.approved = True
-    req.reviewed_at = datetime.utcnow()
-    req.reviewer_id = admin.id
-
-    user = session.get(User, req.user_id)
-    user.coins += req.amount
-    session.add_all([req, user])
+    req = claim_review(session, req_id, admin, approved=True)
+    balance = ledger.apply(session, req.user_id, req.amount, "coin_request", req.id)
+    if balance is None:
+        session.rollback()
+        raise HTTPException(status_code=400, detail="Cannot apply this amount to the user's balance")
 
     note = Notification(
-        user_id=user.id,
+        user_id=req.user_id,
         title="Coin Request Approved",
-        message=f"Your request for {req.amount} coins has been approved. New balance: {user.coins}",
+        message=f"Your request for {req.amount} coins has been approved. New balance: {balance}",
     )
     session.add(note)
+    username = session.get(User, req.user_id).username
     session.commit()
+    invalidate_user(username)
+    broker.publish(req.user_id, {
+        "type": "coin_request",
+        "request_id": req.id,
+        "approved": True,
+        "amount": req.amount,
+        "balance": balance,
+    })
 
     return {"ok": True, "message": "Request approved"}
 
@@ -164,17 +227,7 @@ def reject_coin_request(
     admin=Depends(get_admin_user),
 ):
     """Admin rejects a coin request."""
-    req = session.get(CoinRequest, req_id)
-    if not req:
-        raise HTTPException(status_code=404, detail="Request not found")
-    if req.reviewed:
-        raise HTTPException(status_code=400, detail="Already reviewed")
-
-    req.reviewed = True
-    req.approved = False
-    req.reviewed_at = datetime.utcnow()
-    req.reviewer_id = admin.id
-    session.add(req)
+    req = claim_review(session, req_id, admin, approved=False)
 
     note = Notification(
         user_id=req.user_id,
@@ -183,5 +236,6 @@ def reject_coin_request(
     )
     session.add(note)
     session.commit()
+    broker.publish(req.user_id, {"type": "coin_request", "request_id": req.id, "approved": False, "amount": req.amount})
 
     return {"ok": True, "message": "Request rejected"}
@@ -0,0 +1,106 @@
+"""Push channel for order and coin-request status changes.
+
+``/events/ws`` is a WebSocket; ``/events/stream`` is the Server-Sent Events
+fallback. Both take the usual JWT as ``Authorization: Bearer ...`` or, since
+browsers can't set headers on these, as ``?token=``. The user lookup uses a
+short-lived session, so an idle connection holds no database connection.
+"""
+import asyncio
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket
+from fastapi.responses import StreamingResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.db import async_read_engine
+from app.models import User
+from app.auth import user_from_token, get_admin_user
+from app.services.events import broker, EVENT_HEARTBEAT
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+
+def bearer_token(authorization: Optional[str], token: Optional[str]) -> str:
+    if token:
+        return token
+    scheme, _, value = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not value:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return value
+
+
+async def authenticate(token: str) -> User:
+    async with AsyncSession(async_read_engine, expire_on_commit=False) as session:
+        return await user_from_token(token, session)
+
+
+async def next_event(queue: asyncio.Queue) -> Optional[dict]:
+    """The next event, or None when it's time for a heartbeat."""
+    try:
+        return await asyncio.wait_for(queue.get(), EVENT_HEARTBEAT)
+    except asyncio.TimeoutError:
+        return None
+
+
+# -----------------------------
+# WEBSOCKET
+# -----------------------------
+@router.websocket("/ws")
+async def events_ws(websocket: WebSocket, token: Optional[str] = None):
+    try:
+        user = await authenticate(bearer_token(websocket.headers.get("authorization"), token))
+    except HTTPException:
+        await websocket.close(code=1008)  # policy violation
+        return
+    await websocket.accept()
+    queue = broker.subscribe(user.id)
+
+    async def send_events():
+        while True:
+            event = await next_event(queue)
+            await websocket.send_json(event or {"type": "ping"})
+
+    async def wait_for_close():
+        # Clients don't send anything; reading just notices the disconnect promptly
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    tasks = [asyncio.create_task(send_events()), asyncio.create_task(wait_for_close())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        broker.unsubscribe(user.id, queue)
+
+
+# -----------------------------
+# SERVER-SENT EVENTS
+# -----------------------------
+@router.get("/stream")
+async def events_stream(request: Request, token: Optional[str] = None):
+    user = await authenticate(bearer_token(request.headers.get("authorization"), token))
+    queue = broker.subscribe(user.id)
+
+    async def stream():
+        try:
+            yield f"retry: {int(EVENT_HEARTBEAT * 1000)}\n\n"
+            while True:
+                event = await next_event(queue)
+                if event is None:
+                    yield ": ping\n\n"
+                else:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(user.id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/stats")
+def event_stats(admin=Depends(get_admin_user)):
+    return broker.stats()
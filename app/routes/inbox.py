@@ -0,0 +1,70 @@
+"""The signed-in user's notification inbox.
+
+``User.unread_notifications`` is kept current by SQLite triggers on the
+notification table (migration 5), so the badge count is a primary-key read
+instead of a ``COUNT(*)`` over the inbox.
+"""
+from typing import List
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy import update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.db import get_async_session, get_async_read_session
+from app.models import Notification, User
+from app.schemas import NotificationOut, NotificationMarkRead
+from app.auth import get_current_user
+from app.pagination import Page, keyset, next_page
+
+router = APIRouter(prefix="/notifications", tags=["notifications"])
+
+
+async def unread_count(session: AsyncSession, user_id: int) -> int:
+    # Straight from the row: the cached current_user may be stale
+    return (await session.exec(select(User.unread_notifications).where(User.id == user_id))).one()
+
+
+# -----------------------------
+# INBOX
+# -----------------------------
+@router.get("/inbox", response_model=List[NotificationOut])
+async def inbox(
+    response: Response,
+    unread_only: bool = False,
+    page: Page = Depends(),
+    session: AsyncSession = Depends(get_async_read_session),
+    current_user: User = Depends(get_current_user),
+):
+    query = select(Notification).where(Notification.user_id == current_user.id)
+    if unread_only:
+        query = query.where(Notification.read == False)
+    notes = (await session.exec(keyset(query, Notification, page))).all()
+    return next_page(notes, page, response)
+
+
+@router.get("/unread_count")
+async def get_unread_count(
+    session: AsyncSession = Depends(get_async_read_session),
+    current_user: User = Depends(get_current_user),
+):
+    return {"unread": await unread_count(session, current_user.id)}
+
+
+# -----------------------------
+# MARK READ
+# -----------------------------
+@router.post("/mark_read")
+async def mark_read(
+    body: NotificationMarkRead,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: User = Depends(get_current_user),
+):
+    stmt = (
+        update(Notification)
+        .where(Notification.user_id == current_user.id, Notification.read == False)
+        .values(read=True)
+    )
+    if body.ids is not None:
+        stmt = stmt.where(Notification.id.in_(body.ids))
+    result = await session.execute(stmt)
+    await session.commit()
+    return {"updated": result.rowcount, "unread": await unread_count(session, current_user.id)}
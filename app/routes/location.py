@@ -1,14 +1,14 @@
+import os
 from fastapi import FastAPI, APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Dict
+from app.services.kv import kv
 
 app = FastAPI(title="Delivery Location API")
 
 router = APIRouter(prefix="/location", tags=["Location"])
 
-# Simulate a simple in-memory "database"
-USER_LOCATIONS: Dict[str, dict] = {}
-DELIVERY_TIMES: Dict[str, str] = {}
+# Shared store keys: location:<user_id>, delivery_time:<order_id>
+LOCATION_TTL = float(os.environ.get("LOCATION_TTL", 24 * 3600))
 
 # Request models
 class LocationRequest(BaseModel):
@@ -24,10 +24,11 @@ class DeliveryTimeRequest(BaseModel):
 # 1️⃣ User sends location (from Yandex Map)
 @router.post("/send")
 def send_location(data: LocationRequest):
-    USER_LOCATIONS[data.user_id] = {
+    location = {
         "latitude": data.latitude,
         "longitude": data.longitude
     }
+    kv.set(f"location:{data.user_id}", location, ttl=LOCATION_TTL)
 
     # In a real app, you could notify admin here via Telegram bot or dashboard
     print(f"📍 User {data.user_id} location: {data.latitude}, {data.longitude}")
@@ -35,13 +36,13 @@ def send_location(data: LocationRequest):
     return {
         "status": "success",
         "message": "Location received and sent to admin",
-        "data": USER_LOCATIONS[data.user_id]
+        "data": location
     }
 
 # 2️⃣ Admin checks user location
 @router.get("/user/{user_id}")
 def get_user_location(user_id: str):
-    location = USER_LOCATIONS.get(user_id)
+    location = kv.get(f"location:{user_id}")
     if not location:
         raise HTTPException(status_code=404, detail="User location not found")
 
@@ -53,10 +54,11 @@ def get_user_location(user_id: str):
 # 3️⃣ Admin sends delivery time
 @router.post("/delivery-time")
 def set_delivery_time(data: DeliveryTimeRequest):
-    if data.user_id not in USER_LOCATIONS:
+    if kv.get(f"location:{data.user_id}") is None:
         raise HTTPException(status_code=404, detail="User location not found")
 
-    DELIVERY_TIMES[data.user_id] = data.delivery_time
+    # Keyed by order, which is what the user looks it up by
+    kv.set(f"delivery_time:{data.order_id}", data.delivery_time, ttl=LOCATION_TTL)
 
     print(f"⏰ Admin set delivery time for {data.order_id}: {data.delivery_time}")
 
@@ -68,7 +70,7 @@ def set_delivery_time(data: DeliveryTimeRequest):
 # 4️⃣ User checks delivery time
 @router.get("/delivery-time/{order_id}")
 def get_delivery_time(order_id: str):
-    delivery_time = DELIVERY_TIMES.get(order_id)
+    delivery_time = kv.get(f"delivery_time:{order_id}")
     if not delivery_time:
         raise HTTPException(status_code=404, detail="Delivery time not set yet")
 
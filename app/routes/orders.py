@@ -1,14 +1,26 @@
+import os
 from typing import List, Dict
-from fastapi import APIRouter, Depends, HTTPException
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import insert, update
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime
-from app.db import get_session
-from app.models import Order, User, Product, Notification
+from app.db import get_session, get_read_session, get_async_read_session
+from app.models import Order, User, Product, Notification, Store
 from app.schemas import OrderCreate, OrderDeliveryTime, OrderOut
-from app.auth import get_current_user, get_admin_user
+from app.auth import get_current_user, get_admin_user, invalidate_user
+from app.pagination import Page, keyset, next_page
+from app.services.events import broker
+from app.geo import nearest
+import app.services.ledger as ledger
 
 router = APIRouter(prefix="/orders", tags=["orders"])
 
+# Suggested delivery_time = prep time + straight-line distance at courier speed
+DELIVERY_SPEED_KMH = float(os.environ.get("DELIVERY_SPEED_KMH", 25))
+DELIVERY_PREP_MINUTES = float(os.environ.get("DELIVERY_PREP_MINUTES", 15))
+
 
 # -----------------------------
 # CREATE ORDER
@@ -19,45 +31,47 @@ def create_order(
     session: Session = Depends(get_session),
     current_user=Depends(get_current_user)
 ):
-    total_price = 0
-    total_coins = 0
+    # Look up every price in one IN (...) query
+    product_ids = {item["product_id"] for item in order_in.products}
+    prices = dict(session.exec(
+        select(Product.id, Product.price).where(Product.id.in_(product_ids))
+    ).all())
 
-    # Validate products and calculate total
+    lines = []
+    total_price = 0
     for item in order_in.products:
-        product = session.get(Product, item["product_id"])
-        if not product:
+        price = prices.get(item["product_id"])
+        if price is None:
             raise HTTPException(status_code=404, detail=f"Product {item['product_id']} not found")
         quantity = item.get("quantity", 1)
-        total_price += product.price * quantity
-        total_coins += product.price * quantity
+        # Snapshot the price so later catalog edits don't change the order
+        lines.append({"product_id": item["product_id"], "quantity": quantity, "price": price})
+        total_price += price * quantity
+    total_coins = total_price
 
-    # Create order
+    now = datetime.utcnow()
     order = Order(
         user_id=current_user.id,
-        products=order_in.products,  # JSON column
+        products=lines,  # JSON column
         total_coins=total_coins,
         total_price=total_price,
         status="pending",
         name=order_in.name,
         phone_number=order_in.phone_number,
         address=order_in.address,
-        created_at=datetime.utcnow(),
+        created_at=now,
     )
-
     session.add(order)
-    session.commit()
-    session.refresh(order)
+    session.flush()  # assigns order.id without committing
 
-    # Notify admins
-    admins = session.exec(select(User).where(User.is_admin == True)).all()
-    for admin in admins:
-        note = Notification(
-            user_id=admin.id,
-            title="New Order",
-            message=f"User {current_user.username} placed order #{order.id}. Total: {total_price} coins",
-            created_at=datetime.utcnow()
-        )
-        session.add(note)
+    # Notify admins (bulk insert, same transaction as the order)
+    admin_ids = session.exec(select(User.id).where(User.is_admin == True)).all()
+    message = f"User {current_user.username} placed order #{order.id}. Total: {total_price} coins"
+    if admin_ids:
+        session.execute(insert(Notification), [
+            {"user_id": admin_id, "title": "New Order", "message": message, "read": False, "created_at": now}
+            for admin_id in admin_ids
+        ])
 
     session.commit()
 
@@ -71,8 +85,14 @@ def create_order(
 # LIST ORDERS (ADMIN)
 # -----------------------------
 @router.get("/", response_model=List[OrderOut])
-def list_orders(session: Session = Depends(get_session), admin=Depends(get_admin_user)):
-    return session.exec(select(Order)).all()
+async def list_orders(
+    response: Response,
+    page: Page = Depends(),
+    session: AsyncSession = Depends(get_async_read_session),
+    admin=Depends(get_admin_user),
+):
+    orders = (await session.exec(keyset(select(Order), Order, page))).all()
+    return next_page(orders, page, response)
 
 # -----------------------------
 # DELETE ORDER
@@ -96,64 +116,100 @@ def finish_order(
     session: Session = Depends(get_session),
     current_user=Depends(get_current_user)
 ):
-    order = session.get(Order, order_id)
-
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-
-    if order.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Not your order")
-
-    if order.status != "approved":
+    # Claim the order first: only one request can move it approved -> finished,
+    # and writing first makes SQLite take the write lock up front
+    claimed = session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.user_id == current_user.id, Order.status == "approved")
+        .values(status="finished")
+    ).rowcount
+    if not claimed:
+        order = session.get(Order, order_id)
+        session.rollback()
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if order.user_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Not your order")
         raise HTTPException(status_code=400, detail="Order must be approved first")
 
-    user = session.get(User, current_user.id)
-
-    # User must have enough coins
-    if user.coins < order.total_price:
+    order = session.get(Order, order_id)
+    balance = ledger.apply(session, current_user.id, -order.total_price, "order", order.id)
+    if balance is None:
+        session.rollback()
         raise HTTPException(status_code=400, detail="Not enough coins")
 
-    # Deduct coins
-    user.coins -= order.total_price
-
-    # Transfer coins to admin
-    admin = session.exec(select(User).where(User.is_admin == True)).first()
-    if admin:
-        admin.coins += order.total_price
-        session.add(admin)
-
-    order.status = "finished"
-
-    session.add(order)
-    session.add(user)
+    # Pay the treasury account
+    treasury = ledger.treasury(session)
+    if treasury:
+        ledger.apply(session, treasury.id, order.total_price, "order_payment", order.id)
 
     # Notify user
     note = Notification(
-        user_id=user.id,
+        user_id=current_user.id,
         title="Order Completed",
-        message=f"You paid {order.total_price} coins. New balance: {user.coins}",
+        message=f"You paid {order.total_price} coins. New balance: {balance}",
         created_at=datetime.utcnow(),
     )
     session.add(note)
 
     session.commit()
+    invalidate_user(current_user.username)
+    if treasury:
+        invalidate_user(treasury.username)
+    broker.publish(current_user.id, {"type": "order", "order_id": order_id, "status": "finished"})
 
     return {
         "ok": True,
-        "new_balance": user.coins
+        "new_balance": balance
     }
 
 
 @router.get("/my_orders", response_model=List[OrderOut])
 def my_orders(
-    session: Session = Depends(get_session),
+    response: Response,
+    page: Page = Depends(),
+    session: Session = Depends(get_read_session),
     current_user=Depends(get_current_user)
 ):
     orders = session.exec(
-        select(Order).where(Order.user_id == current_user.id)
+        keyset(select(Order).where(Order.user_id == current_user.id), Order, page)
+    ).all()
+
+    return next_page(orders, page, response)
+
+
+# -----------------------------
+# DISPATCH SUGGESTIONS (ADMIN)
+# -----------------------------
+@router.get("/dispatch")
+def dispatch_suggestions(session: Session = Depends(get_read_session), admin=Depends(get_admin_user)):
+    """Nearest store and a suggested delivery_time for every pending order."""
+    orders = session.exec(
+        select(Order.id, Order.latitude, Order.longitude)
+        .where(Order.status == "pending", Order.latitude.is_not(None), Order.longitude.is_not(None))
     ).all()
+    stores = session.exec(
+        select(Store.id, Store.name, Store.latitude, Store.longitude)
+        .where(Store.latitude.is_not(None), Store.longitude.is_not(None))
+    ).all()
+    if not orders or not stores:
+        return []
 
-    return orders
+    index, distance = nearest(
+        [o.latitude for o in orders], [o.longitude for o in orders],
+        [s.latitude for s in stores], [s.longitude for s in stores],
+    )
+    eta = np.ceil(DELIVERY_PREP_MINUTES + distance / DELIVERY_SPEED_KMH * 60).astype(int)
+    return [
+        {
+            "order_id": order.id,
+            "store_id": stores[i].id,
+            "store_name": stores[i].name,
+            "distance_km": round(float(d), 3),
+            "suggested_delivery_time": int(minutes),
+        }
+        for order, i, d, minutes in zip(orders, index.tolist(), distance, eta)
+    ]
 
 
 @router.post("/order_delivery_time")
@@ -173,6 +229,12 @@ def order_delivery_time(
     session.add(order)
     session.commit()
     session.refresh(order)
+    broker.publish(order.user_id, {
+        "type": "order",
+        "order_id": order.id,
+        "status": order.status,
+        "delivery_time": order.delivery_time,
+    })
 
     return {
             "message": "Delivery time set successfully",
@@ -1,17 +1,37 @@
 import os
-from fastapi import APIRouter, Depends, HTTPException, Form, File, UploadFile, Request
+import re
+import json
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Form, File, UploadFile, Request, Response, Query
 from typing import Optional
+from sqlalchemy import column, table, text
 from sqlmodel import Session, select
-from app.db import get_session, UPLOAD_DIR
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.db import get_session, get_read_session, get_async_read_session, UPLOAD_DIR
 from app.models import Product, Store
 from app.auth import get_admin_user, get_current_user
-from app.utils import save_upload_uploadfile
+from app.utils import save_upload_uploadfile, product_columns, product_to_dict
+from app.pagination import Page, keyset, split_page, NEXT_CURSOR_HEADER
+import app.services.catalog_cache as catalog_cache
+from app.services.images import build_derivatives_safe
+import app.services.product_import as product_import
 
 router = APIRouter(prefix="/products", tags=["products"])
 
+# FTS5 index created by migration 3 and kept in sync by triggers on product
+product_fts = table("product_fts", column("rowid"))
+# bm25 weights per indexed column: titles count ten times more than descriptions
+FTS_RANK = "bm25(product_fts, 10.0, 1.0, 10.0, 1.0, 10.0, 1.0)"
+
+
+def build_product_images(image_path: str, store_id: int):
+    # Cached pages were rendered before the variants existed
+    if build_derivatives_safe(image_path):
+        catalog_cache.invalidate(store_id)
+
 
 @router.post("/")
 def create_product(
+    background_tasks: BackgroundTasks,
     title_in_uzb: str = Form(...),
     title_in_rus: str = Form(...),
     title_in_eng: str = Form(...),
@@ -30,7 +50,7 @@ def create_product(
 
     image_path = None
     if image:
-        image_path = save_upload_uploadfile(image, UPLOAD_DIR)
+        image_path = save_upload_uploadfile(image)
 
     p = Product(
         title_in_uzb=title_in_uzb,
@@ -49,6 +69,9 @@ def create_product(
     session.add(p)
     session.commit()
     session.refresh(p)
+    catalog_cache.invalidate(store_id)
+    if image_path:
+        background_tasks.add_task(build_product_images, image_path, store_id)
 
     return {
         "id": p.id,
@@ -66,70 +89,116 @@ def create_product(
 
 
 
-def product_by_language(product, language):
-    if language == 0:
-        return product.title_in_uzb, product.description_in_uzb
-    elif language == 1:
-        return product.title_in_rus, product.description_in_rus
-    else:
-        return product.title_in_eng, product.description_in_eng
+def build_imported_images(image_paths: set):
+    for image_path in image_paths:
+        build_derivatives_safe(image_path)
+    catalog_cache.invalidate()
+
+
+@router.post("/import")
+def import_products(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(..., description="CSV with a header row, or JSON Lines"),
+    images: Optional[UploadFile] = File(None, description="Zip of the files named in the image column"),
+    format: Optional[str] = Form(None, description="csv or jsonl; guessed from the file name if omitted"),
+    batch_size: int = Form(product_import.IMPORT_BATCH_SIZE, ge=1, le=10000),
+    session: Session = Depends(get_session),
+    admin=Depends(get_admin_user),
+):
+    fmt = (format or "").lower() or ("jsonl" if (file.filename or "").lower().endswith((".jsonl", ".ndjson")) else "csv")
+    if fmt not in ("csv", "jsonl"):
+        raise HTTPException(status_code=400, detail="format must be csv or jsonl")
+
+    report, image_paths = product_import.import_products(
+        session, file.file, fmt, images.file if images else None, batch_size
+    )
+    for store_id in report["stores"]:
+        catalog_cache.invalidate(store_id)
+    if image_paths:
+        background_tasks.add_task(build_imported_images, image_paths)
+    return report
 
 
 @router.get("/")
-def list_products(
+async def list_products(
     request: Request,
     store_id: Optional[int] = None,
-    session: Session = Depends(get_session),
+    page: Page = Depends(),
+    session: AsyncSession = Depends(get_async_read_session),
     user=Depends(get_current_user),
 ):
-    q = select(Product)
-    if store_id:
-        q = q.where(Product.store_id == store_id)
-
-    products = session.exec(q).all()
     base_url = str(request.base_url).rstrip("/")
 
-    result = []
-    for p in products:
-        title, description = product_by_language(p, user.language)
+    async def load():
+        q = select(*product_columns(user.language))
+        if store_id:
+            q = q.where(Product.store_id == store_id)
+
+        rows, cursor = split_page((await session.exec(keyset(q, Product, page))).all(), page)
+        result = [product_to_dict(row, base_url) for row in rows]
+
+        return json.dumps(result, ensure_ascii=False).encode(), cursor
 
-        image_url = None
-        if p.image_path:
-            image_url = f"{base_url}/uploads/{os.path.basename(p.image_path)}"
+    key = (store_id or None, user.language, page.limit, page.after, base_url)
+    body, cursor = await catalog_cache.fetch(key, load)
+    headers = {NEXT_CURSOR_HEADER: cursor} if cursor else None
+    return Response(content=body, media_type="application/json", headers=headers)
 
-        result.append({
-            "id": p.id,
-            "title": title,
-            "description": description,
-            "price": p.price,
-            "store_id": p.store_id,
-            "image_url": image_url,
-        })
 
-    return result
+def fts_query(q: str) -> str:
+    """Turn free text into an FTS5 query: every word must match as a prefix."""
+    words = re.findall(r"\w+", q)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+@router.get("/search")
+async def search_products(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    store_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    session: AsyncSession = Depends(get_async_read_session),
+    user=Depends(get_current_user),
+):
+    match = fts_query(q)
+    if not match:
+        return []
+
+    stmt = (
+        select(*product_columns(user.language))
+        .join(product_fts, product_fts.c.rowid == Product.id)
+        .where(text("product_fts MATCH :match").bindparams(match=match))
+        .order_by(text(FTS_RANK))
+        .limit(limit)
+    )
+    if store_id:
+        stmt = stmt.where(Product.store_id == store_id)
+
+    base_url = str(request.base_url).rstrip("/")
+    rows = (await session.exec(stmt)).all()
+    return [product_to_dict(row, base_url) for row in rows]
+
+
+@router.get("/cache_stats")
+def catalog_cache_stats(admin=Depends(get_admin_user)):
+    return catalog_cache.stats()
 
 
 @router.get("/{product_id}")
-def get_product(product_id: int, request: Request, session: Session = Depends(get_session)):
-    p = session.get(Product, product_id)
-    if not p:
+def get_product(
+    product_id: int,
+    request: Request,
+    session: Session = Depends(get_read_session),
+    user=Depends(get_current_user),
+):
+    row = session.exec(
+        select(*product_columns(user.language)).where(Product.id == product_id)
+    ).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Product not found")
 
     base_url = str(request.base_url).rstrip("/")
-    image_url = None
-    if p.image_path:
-        filename = os.path.basename(p.image_path)
-        image_url = f"{base_url}/uploads/{filename}"
-
-    return {
-        "id": p.id,
-        "title": p.title,
-        "description": p.description,
-        "price": p.price,
-        "store_id": p.store_id,
-        "created_at": p.created_at,
-        "image_url": image_url,
-    }
+    return {**product_to_dict(row, base_url), "created_at": row.created_at}
 
 
 @router.delete("/{product_id}")
@@ -144,5 +213,6 @@ def delete_product(
 
     session.delete(p)
     session.commit()
+    catalog_cache.invalidate(p.store_id)
 
     return {"status": "success", "message": "Product deleted"}
\ No newline at end of file
@@ -1,15 +1,31 @@
 # app/routes/stores.py (Updated to handle latitude/longitude)
-from fastapi import APIRouter, Depends, HTTPException
+import os
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from sqlalchemy import and_, column, or_, table
 from sqlmodel import Session, select
-from app.db import get_session
+from app.db import get_session, get_read_session
 from app.models import Store, Product
 from app.schemas import StoreCreate
 from app.auth import get_admin_user
+import app.services.catalog_cache as catalog_cache
+from app.services.images import build_derivatives_safe
+from app.services.storage import local_path
+from app.geo import bounding_boxes, haversine_km
 
 router = APIRouter(prefix="/stores", tags=["stores"])
 
+# R*Tree over store coordinates, created by migration 7 and kept in sync by triggers
+store_rtree = table(
+    "store_rtree", column("id"), column("min_lat"), column("max_lat"), column("min_lon"), column("max_lon")
+)
+
 @router.post("/")
-def create_store(store_in: StoreCreate, session: Session = Depends(get_session), admin=Depends(get_admin_user)):
+def create_store(
+    store_in: StoreCreate,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_session),
+    admin=Depends(get_admin_user),
+):
     s = Store(
         name=store_in.name,
         store_photo=store_in.store_photo,
@@ -20,12 +36,46 @@ def create_store(store_in: StoreCreate, session: Session = Depends(get_session),
     session.add(s)
     session.commit()
     session.refresh(s)
+    catalog_cache.invalidate(s.id)
+    # store_photo is a path; only uploaded files get derivatives
+    if s.store_photo and os.path.isfile(local_path(s.store_photo)):
+        background_tasks.add_task(build_derivatives_safe, s.store_photo)
     return {"id": s.id, "name": s.name}
 
 @router.get("/")
-def list_stores(session: Session = Depends(get_session)):
+def list_stores(session: Session = Depends(get_read_session)):
     return session.exec(select(Store)).all()
 
+@router.get("/nearby")
+def nearby_stores(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(5.0, gt=0, le=500, description="Search radius in km"),
+    limit: int = Query(20, ge=1, le=100),
+    session: Session = Depends(get_read_session),
+):
+    boxes = bounding_boxes(lat, lon, radius)
+    if session.get_bind().dialect.name == "sqlite":
+        # Index lookup for the bounding box(es), then the exact distance below
+        r = store_rtree.c
+        stmt = select(Store).join(store_rtree, r.id == Store.id).where(or_(*(
+            and_(r.max_lat >= min_lat, r.min_lat <= max_lat, r.max_lon >= min_lon, r.min_lon <= max_lon)
+            for min_lat, max_lat, min_lon, max_lon in boxes
+        )))
+    else:
+        stmt = select(Store).where(or_(*(
+            and_(Store.latitude.between(min_lat, max_lat), Store.longitude.between(min_lon, max_lon))
+            for min_lat, max_lat, min_lon, max_lon in boxes
+        )))
+
+    hits = []
+    for store in session.exec(stmt):
+        distance = haversine_km(lat, lon, store.latitude, store.longitude)
+        if distance <= radius:
+            hits.append((distance, store))
+    hits.sort(key=lambda hit: hit[0])
+    return [{**store.model_dump(), "distance_km": round(distance, 3)} for distance, store in hits[:limit]]
+
 @router.delete("/{store_id}")
 def delete_store(store_id: int, session: Session = Depends(get_session), admin=Depends(get_admin_user)):
     store = session.get(Store, store_id)
@@ -36,4 +86,5 @@ def delete_store(store_id: int, session: Session = Depends(get_session), admin=D
         raise HTTPException(status_code=400, detail="Cannot delete store with products")
     session.delete(store)
     session.commit()
+    catalog_cache.invalidate(store_id)
     return {"ok": True}
\ No newline at end of file
@@ -0,0 +1,74 @@
+"""Serve /uploads with validators and long-lived caching.
+
+Content-addressed blobs (and their derivatives) never change under the same
+name, so they are sent with ``Cache-Control: immutable`` and their hash as a
+strong ETag. ``If-None-Match`` gets a 304, Range requests are answered by
+Starlette's FileResponse, and servers that implement the ASGI pathsend
+extension transfer the body zero-copy. A sibling ``.br``/``.gz`` file is
+served instead when the client accepts that encoding.
+"""
+import mimetypes
+import os
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import FileResponse
+from app.db import UPLOAD_DIR
+from app.services.storage import BLOB_RE
+
+router = APIRouter(tags=["uploads"])
+
+UPLOADS_MAX_AGE = int(os.environ.get("UPLOADS_MAX_AGE", 3600))
+IMMUTABLE = "public, max-age=31536000, immutable"
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 prescribes for If-None-Match
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+@router.api_route("/uploads/{path:path}", methods=["GET", "HEAD"], name="uploads")
+def serve_upload(path: str, request: Request):
+    root = os.path.realpath(UPLOAD_DIR)
+    full = os.path.realpath(os.path.join(root, path))
+    if not full.startswith(root + os.sep) or not os.path.isfile(full):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    blob = BLOB_RE.match(f"uploads/{path}")
+    if blob:
+        etag = f'"{blob.group(1)}{blob.group(2) or ""}"'
+        cache_control = IMMUTABLE
+    else:
+        st = os.stat(full)
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+        cache_control = f"public, max-age={UPLOADS_MAX_AGE}"
+
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    media_type = mimetypes.guess_type(full)[0] or "application/octet-stream"
+
+    accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+    for encoding, suffix in PRECOMPRESSED:
+        if encoding in accepted and os.path.isfile(full + suffix):
+            full += suffix
+            etag = f'{etag[:-1]}-{encoding}"'
+            headers["Content-Encoding"] = encoding
+            break
+
+    headers["ETag"] = etag
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(full, headers=headers, media_type=media_type)
@@ -1,16 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select, Session
-from app.db import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.db import get_session, get_read_session, get_async_session
 from app.models import User
 from app.schemas import UserCreate, Token, UserUpdate
 from app.auth import (
-    verify_password,
-    get_password_hash,
     create_access_token,
     get_current_user,
     get_admin_user,
+    invalidate_user,
+    token_cache,
+    user_cache,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from app.pagination import Page, keyset, next_page
+from app.services.hashing import hash_password, verify_password
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
 from fastapi import Body
@@ -18,10 +23,10 @@ from fastapi import Body
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 @router.post("/register")
-def register(user_create: UserCreate, session: Session = Depends(get_session)):
-    if session.exec(select(User).where(User.username == user_create.username)).first():
+async def register(user_create: UserCreate, session: AsyncSession = Depends(get_async_session)):
+    if (await session.exec(select(User).where(User.username == user_create.username))).first():
         raise HTTPException(status_code=400, detail="Username already exists")
-    hashed = get_password_hash(user_create.password)
+    hashed = await hash_password(user_create.password)
     user = User(
         username=user_create.username,
         hashed_password=hashed,
@@ -31,21 +36,33 @@ def register(user_create: UserCreate, session: Session = Depends(get_session)):
         language=user_create.language
     )
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    try:
+        await session.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent registration of the same username
+        raise HTTPException(status_code=400, detail="Username already exists")
+    await session.refresh(user)
     return {"id": user.id, "username": user.username, "language": user.language}
 
 @router.post("/token", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_session)):
+    user = (await session.exec(select(User).where(User.username == form_data.username))).first()
+    if not user:
+        raise HTTPException(status_code=400, detail="Incorrect username or password")
+    ok, new_hash = await verify_password(form_data.password, user.hashed_password)
+    if not ok:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
+    if new_hash:
+        # Stored hash used an old cost factor; upgrade it now that we know the password
+        user.hashed_password = new_hash
+        session.add(user)
+        await session.commit()
     expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     token = create_access_token(data={"sub": user.username}, expires_delta=expires)
     return {"access_token": token, "token_type": "bearer", "user_id": user.id}
 
 @router.get("/me")
-def me(current_user: User = Depends(get_current_user)):
+async def me(current_user: User = Depends(get_current_user)):
     return {
         "id": current_user.id,
         "username": current_user.username,
@@ -61,24 +78,39 @@ def update_me(
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
+    # current_user comes from the async session, so reload it in this one
+    user = session.get(User, current_user.id)
+
     # Faqat kiritilgan maydonlarni yangilaymiz
     for field, value in user_update.dict(exclude_unset=True).items():
-        setattr(current_user, field, value)
+        setattr(user, field, value)
     
-    session.add(current_user)
+    session.add(user)
     session.commit()
-    session.refresh(current_user)
+    session.refresh(user)
+    invalidate_user(user.username)
 
     return {
-        "id": current_user.id,
-        "username": current_user.username,
-        "full_name": current_user.full_name,
-        "email": current_user.email,
-        "phone_number": current_user.phone_number,
-        "language": current_user.language
+        "id": user.id,
+        "username": user.username,
+        "full_name": user.full_name,
+        "email": user.email,
+        "phone_number": user.phone_number,
+        "language": user.language
     }
 
 
 @router.get("/users")
-def list_users(session: Session = Depends(get_session), admin: User = Depends(get_admin_user)):
-    return session.exec(select(User)).all()
\ No newline at end of file
+def list_users(
+    response: Response,
+    page: Page = Depends(),
+    session: Session = Depends(get_read_session),
+    admin: User = Depends(get_admin_user),
+):
+    users = session.exec(keyset(select(User), User, page)).all()
+    return next_page(users, page, response)
+
+
+@router.get("/cache_stats")
+def cache_stats(admin: User = Depends(get_admin_user)):
+    return {"tokens": token_cache.stats(), "users": user_cache.stats()}
@@ -62,6 +62,17 @@ class NotificationOut(BaseModel):
     read: bool
     created_at: datetime
 
+class NotificationMarkRead(BaseModel):
+    ids: Optional[List[int]] = None  # None marks every notification as read
+
+class CoinLedgerOut(BaseModel):
+    id: int
+    user_id: int
+    amount: int
+    reason: str
+    ref_id: Optional[int]
+    created_at: datetime
+
 class OrderCreate(BaseModel):
     products: List[Dict[str, int]]  # [{"product_id": 1, "quantity": 2}, ...]
     name: str
@@ -0,0 +1,54 @@
+"""Read-through response cache for GET /products/.
+
+Pages are cached as rendered JSON keyed by ``(store_id, language, ...)`` and
+dropped as soon as a product or store write touches that store. The cache is
+per process; other workers catch up within ``CATALOG_CACHE_TTL`` seconds.
+"""
+import os
+from typing import Awaitable, Callable, Optional, Tuple
+from app.cache import TTLCache, SingleFlight
+
+CATALOG_CACHE_SIZE = int(os.environ.get("CATALOG_CACHE_SIZE", 2048))
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", 60))
+CATALOG_CACHE_MAX_BYTES = int(os.environ.get("CATALOG_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+cache = TTLCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL, max_bytes=CATALOG_CACHE_MAX_BYTES)
+_flight = SingleFlight()
+
+# Bumped on every invalidation so a load that started before a write
+# never stores its (now stale) result afterwards.
+_generation = 0
+
+
+async def fetch(key: tuple, loader: Callable[[], Awaitable[Tuple[bytes, Optional[str]]]]):
+    """Return the cached ``(body, next_cursor)`` for ``key`` or load it once.
+
+    ``key`` must start with ``(store_id, language)``.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+
+    async def load():
+        generation = _generation
+        entry = await loader()
+        if generation == _generation:
+            cache.set(key, entry, size=len(entry[0]))
+        return entry
+
+    return await _flight.do(key, load)
+
+
+def invalidate(store_id: Optional[int] = None) -> int:
+    """Drop pages for ``store_id`` (plus the all-stores listing), or everything."""
+    global _generation
+    _generation += 1
+    if store_id is None:
+        count = len(cache)
+        cache.clear()
+        return count
+    return cache.pop_where(lambda key: key[0] is None or key[0] == store_id)
+
+
+def stats() -> dict:
+    return {**cache.stats(), "ttl": CATALOG_CACHE_TTL}
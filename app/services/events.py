@@ -0,0 +1,67 @@
+"""In-process fan-out of status events to connected clients.
+
+Handlers call ``broker.publish(user_id, event)`` after their commit; every
+WebSocket/SSE connection of that user has a small bounded queue that the
+event is dropped into. ``publish`` is safe to call from the sync handlers that
+run in the threadpool. The registry is per process: with several workers a
+client only sees events published by the worker that holds its connection.
+"""
+import asyncio
+import os
+import threading
+from typing import Dict, Optional, Set
+
+EVENT_QUEUE_SIZE = int(os.environ.get("EVENT_QUEUE_SIZE", 100))
+EVENT_HEARTBEAT = float(os.environ.get("EVENT_HEARTBEAT", 25))  # seconds between keep-alives
+
+
+class EventBroker:
+    def __init__(self):
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self.dropped = 0
+
+    def start(self):
+        """Bind to the running event loop; called from app startup."""
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id: int, event: dict):
+        """Send ``event`` to every open connection of ``user_id``."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        if threading.get_ident() == self._thread_id:
+            self._deliver(user_id, event)
+        else:
+            self._loop.call_soon_threadsafe(self._deliver, user_id, event)
+
+    def _deliver(self, user_id: int, event: dict):
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                # Slow client: lose the oldest event rather than block everyone
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._subscribers),
+            "connections": sum(len(q) for q in self._subscribers.values()),
+            "dropped": self.dropped,
+        }
+
+
+broker = EventBroker()
@@ -0,0 +1,78 @@
+"""Password hashing on a dedicated process pool.
+
+bcrypt is deliberately slow, so running it inline in a handler ties up a worker
+thread (or the event loop) for every login. Here it runs in ``HASH_WORKERS``
+processes with at most ``HASH_QUEUE_SIZE`` calls waiting; beyond that callers get
+an immediate 503 with ``Retry-After`` instead of stalling unrelated endpoints.
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE_SIZE = int(os.environ.get("HASH_QUEUE_SIZE", 64))
+HASH_RETRY_AFTER = int(os.environ.get("HASH_RETRY_AFTER", 1))
+
+# Pinning min/max to the configured cost makes needs_update() flag any hash made
+# with a different cost, so logins rehash transparently after BCRYPT_ROUNDS changes.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pending = 0
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, hashed)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+    return _executor
+
+
+async def _submit(fn, *args):
+    global _pending
+    if _pending >= HASH_WORKERS + HASH_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many password checks in progress, try again shortly",
+            headers={"Retry-After": str(HASH_RETRY_AFTER)},
+        )
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _submit(_hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """Return ``(ok, new_hash)``; ``new_hash`` is set when the stored cost is stale."""
+    return await _submit(_verify_and_update, password, hashed)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
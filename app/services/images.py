@@ -0,0 +1,94 @@
+"""Resized, metadata-free derivatives of uploaded images.
+
+Every product, store and coin-receipt image gets a copy at each width in
+``IMAGE_WIDTHS`` (never upscaled), written next to the original as
+``<name>_w<width>.<ext>``. Handlers schedule ``build_derivatives`` as a
+background task; ``python -m app.services.images`` backfills existing uploads.
+"""
+import os
+import re
+import traceback
+from typing import Dict, List
+from PIL import Image, ImageOps
+from app.db import UPLOAD_DIR
+from app.services.storage import local_path, public_url
+
+IMAGE_WIDTHS = sorted(int(w) for w in os.environ.get("IMAGE_WIDTHS", "160,480,1080").split(","))
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "webp").lower()  # "webp" or "jpeg"
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", 80))
+
+_EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+VARIANT_EXT = _EXTENSIONS[IMAGE_FORMAT]
+_VARIANT_RE = re.compile(r"_w\d+\.(webp|jpg)$")
+
+
+def variant_path(rel_path: str, width: int) -> str:
+    root, _ = os.path.splitext(rel_path)
+    return f"{root}_w{width}.{VARIANT_EXT}"
+
+
+def is_variant(path: str) -> bool:
+    return bool(_VARIANT_RE.search(path))
+
+
+def build_derivatives(rel_path: str) -> List[str]:
+    """Write the missing derivatives of ``rel_path``; returns the new paths."""
+    created = []
+    with Image.open(local_path(rel_path)) as original:
+        im = ImageOps.exif_transpose(original)
+        if IMAGE_FORMAT == "jpeg" or im.mode not in ("RGB", "RGBA"):
+            has_alpha = im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info
+            im = im.convert("RGBA" if has_alpha and IMAGE_FORMAT == "webp" else "RGB")
+
+        for width in IMAGE_WIDTHS:
+            if width >= im.width:
+                break
+            out_rel = variant_path(rel_path, width)
+            out = local_path(out_rel)
+            if os.path.exists(out):
+                continue
+            height = max(1, round(im.height * width / im.width))
+            resized = im.resize((width, height), Image.LANCZOS)
+            resized.info = {}  # no EXIF/ICC/text chunks in the derivative
+            tmp = f"{out}.tmp"
+            resized.save(tmp, format=IMAGE_FORMAT.upper(), quality=IMAGE_QUALITY, optimize=True)
+            os.replace(tmp, out)
+            created.append(out_rel)
+    return created
+
+
+def build_derivatives_safe(rel_path: str) -> List[str]:
+    """Background-task wrapper: a bad upload must not crash the worker."""
+    try:
+        return build_derivatives(rel_path)
+    except Exception:
+        traceback.print_exc()
+        return []
+
+
+def variant_urls(rel_path: str, base_url: str) -> Dict[str, str]:
+    """URLs of the derivatives that exist for ``rel_path``, keyed by width."""
+    urls = {}
+    for width in IMAGE_WIDTHS:
+        path = variant_path(rel_path, width)
+        if os.path.exists(local_path(path)):
+            urls[str(width)] = public_url(path, base_url)
+    return urls
+
+
+def backfill() -> int:
+    count = 0
+    for root, _, files in os.walk(UPLOAD_DIR):
+        for name in files:
+            if is_variant(name) or name.endswith(".tmp"):
+                continue
+            rel = os.path.relpath(os.path.join(root, name), UPLOAD_DIR).replace(os.sep, "/")
+            created = build_derivatives_safe(f"uploads/{rel}")
+            if created:
+                count += 1
+                print(f"🖼️ {rel}: {len(created)} derivatives")
+    return count
+
+
+if __name__ == "__main__":
+    print(f"✅ Backfilled derivatives for {backfill()} images")
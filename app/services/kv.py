@@ -0,0 +1,231 @@
+"""Small shared key-value store with TTLs.
+
+Holds the state that used to live in module dicts (locations, delivery times,
+push tokens, ...) so it is bounded and, with a shared backend, the same in
+every worker. ``KV_BACKEND`` picks the backend:
+
+* ``sqlite`` (default): a ``kv`` table in the app database, or in ``KV_URL``
+* ``memory``: per-process LRU; fine for a single worker
+* ``redis``: ``KV_URL`` (``redis://...``); needs the optional ``redis`` package
+* ``fakeredis``: in-process Redis stand-in for tests (``fakeredis`` package)
+
+Values are anything JSON-serializable. Keys are plain strings; callers
+namespace them with a ``prefix:`` so ``scan(prefix)`` can list a group.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Iterator, Optional, Tuple
+from sqlalchemy import create_engine, text
+from app.cache import TTLCache
+from app.db import engine
+
+KV_BACKEND = os.environ.get("KV_BACKEND", "sqlite").lower()
+KV_URL = os.environ.get("KV_URL")
+KV_MAX_KEYS = int(os.environ.get("KV_MAX_KEYS", 100000))
+KV_DEFAULT_TTL = float(os.environ.get("KV_DEFAULT_TTL", 7 * 24 * 3600))
+KV_PURGE_EVERY = int(os.environ.get("KV_PURGE_EVERY", 500))  # sqlite: writes between purges
+
+_MISSING = object()
+
+# ttl=None means KV_DEFAULT_TTL; pass NO_EXPIRY for keys that must not expire
+NO_EXPIRY = 0
+
+
+def _ttl(ttl: Optional[float]) -> Optional[float]:
+    ttl = KV_DEFAULT_TTL if ttl is None else ttl
+    return ttl if ttl > 0 else None
+
+
+class MemoryKV:
+    def __init__(self, maxsize: int = KV_MAX_KEYS):
+        self._cache = TTLCache(maxsize=maxsize, ttl=float("inf"))
+        self._lock = threading.Lock()  # makes add/incr atomic
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._cache.get(key, default)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._cache.set(key, value, ttl=_ttl(ttl) or float("inf"))
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._cache.get(key, _MISSING) is not _MISSING:
+                return False
+            self.set(key, value, ttl)
+            return True
+
+    def delete(self, key: str) -> bool:
+        return self._cache.pop(key, _MISSING) is not _MISSING
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = NO_EXPIRY) -> int:
+        with self._lock:
+            value = self._cache.get(key, _MISSING)
+            if value is _MISSING:
+                self.set(key, amount, ttl)
+                return amount
+            # Keep the key's original expiry
+            self._cache.set(key, value + amount, ttl=self._cache.ttl_left(key))
+            return value + amount
+
+    def scan(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        return iter([(k, v) for k, v in self._cache.items() if k.startswith(prefix)])
+
+
+class SQLiteKV:
+    """``kv(key, value, expires_at)`` table; expired rows are invisible and purged in batches."""
+
+    def __init__(self, bind=engine, maxsize: int = KV_MAX_KEYS):
+        self.bind = bind
+        self.maxsize = maxsize
+        self._writes = 0
+        self._ready = False
+
+    def _conn(self):
+        if not self._ready:
+            with self.bind.begin() as conn:
+                conn.execute(text(
+                    "CREATE TABLE IF NOT EXISTS kv ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+                ))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_kv_expires_at ON kv (expires_at)"))
+            self._ready = True
+        return self.bind.begin()
+
+    @staticmethod
+    def _expires_at(ttl: Optional[float]) -> Optional[float]:
+        ttl = _ttl(ttl)
+        return time.time() + ttl if ttl else None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._conn() as conn:
+            value = conn.execute(
+                text("SELECT value FROM kv WHERE key = :k AND (expires_at IS NULL OR expires_at > :now)"),
+                {"k": key, "now": time.time()},
+            ).scalar()
+        return default if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._conn() as conn:
+            conn.execute(
+                text("INSERT INTO kv (key, value, expires_at) VALUES (:k, :v, :e) "
+                     "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at"),
+                {"k": key, "v": json.dumps(value), "e": self._expires_at(ttl)},
+            )
+        self._wrote()
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        with self._conn() as conn:
+            # Only an expired row may be overwritten
+            result = conn.execute(
+                text("INSERT INTO kv (key, value, expires_at) VALUES (:k, :v, :e) "
+                     "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                     "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= :now"),
+                {"k": key, "v": json.dumps(value), "e": self._expires_at(ttl), "now": time.time()},
+            )
+        self._wrote()
+        return result.rowcount == 1
+
+    def delete(self, key: str) -> bool:
+        with self._conn() as conn:
+            return conn.execute(text("DELETE FROM kv WHERE key = :k"), {"k": key}).rowcount == 1
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = NO_EXPIRY) -> int:
+        expired = "kv.expires_at IS NOT NULL AND kv.expires_at <= :now"
+        with self._conn() as conn:
+            value = conn.execute(
+                text("INSERT INTO kv (key, value, expires_at) VALUES (:k, :a, :e) "
+                     "ON CONFLICT(key) DO UPDATE SET "
+                     f"value = CASE WHEN {expired} THEN :a ELSE CAST(kv.value AS INTEGER) + :a END, "
+                     f"expires_at = CASE WHEN {expired} THEN :e ELSE kv.expires_at END "
+                     "RETURNING value"),
+                {"k": key, "a": amount, "e": self._expires_at(ttl), "now": time.time()},
+            ).scalar()
+        self._wrote()
+        return int(value)
+
+    def scan(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        # Range on the primary key instead of LIKE, so it is an index seek
+        with self._conn() as conn:
+            rows = conn.execute(
+                text("SELECT key, value FROM kv WHERE key >= :lo AND key < :hi "
+                     "AND (expires_at IS NULL OR expires_at > :now) ORDER BY key"),
+                {"lo": prefix, "hi": prefix + "\U0010ffff", "now": time.time()},
+            ).all()
+        return iter([(k, json.loads(v)) for k, v in rows])
+
+    def purge(self) -> int:
+        """Delete expired rows, then the soonest-expiring ones above ``maxsize``."""
+        with self._conn() as conn:
+            removed = conn.execute(
+                text("DELETE FROM kv WHERE expires_at <= :now"), {"now": time.time()}
+            ).rowcount
+            removed += conn.execute(
+                text("DELETE FROM kv WHERE key IN (SELECT key FROM kv "
+                     "ORDER BY expires_at IS NULL, expires_at LIMIT max(0, (SELECT COUNT(*) FROM kv) - :max))"),
+                {"max": self.maxsize},
+            ).rowcount
+        return removed
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % KV_PURGE_EVERY == 0:
+            self.purge()
+
+
+class RedisKV:
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self.client.get(key)
+        return default if value is None else json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = _ttl(ttl)
+        self.client.set(key, json.dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        ttl = _ttl(ttl)
+        return bool(self.client.set(key, json.dumps(value), nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def delete(self, key: str) -> bool:
+        return self.client.delete(key) == 1
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = NO_EXPIRY) -> int:
+        value = self.client.incrby(key, amount)
+        ttl = _ttl(ttl)
+        if ttl and value == amount:  # first increment created the key
+            self.client.pexpire(key, int(ttl * 1000))
+        return value
+
+    def scan(self, prefix: str) -> Iterator[Tuple[str, Any]]:
+        pattern = "".join("\\" + c if c in "*?[]\\" else c for c in prefix) + "*"
+        for key in self.client.scan_iter(match=pattern, count=500):
+            value = self.client.get(key)
+            if value is not None:
+                yield (key.decode() if isinstance(key, bytes) else key), json.loads(value)
+
+
+def create_store(backend: str = KV_BACKEND, url: Optional[str] = KV_URL):
+    if backend == "memory":
+        return MemoryKV()
+    if backend == "sqlite":
+        return SQLiteKV(create_engine(url) if url else engine)
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("KV_BACKEND=redis needs the redis package (pip install redis)")
+        return RedisKV(redis.Redis.from_url(url or "redis://localhost:6379/0"))
+    if backend == "fakeredis":
+        try:
+            import fakeredis
+        except ImportError:
+            raise RuntimeError("KV_BACKEND=fakeredis needs the fakeredis package (pip install fakeredis)")
+        return RedisKV(fakeredis.FakeRedis())
+    raise RuntimeError(f"Unknown KV_BACKEND: {backend}")
+
+
+kv = create_store()
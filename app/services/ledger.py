@@ -0,0 +1,112 @@
+"""Coin balances: conditional updates plus an append-only ledger.
+
+Every change is one ``UPDATE "user" SET coins = coins + :amount WHERE id = :id
+AND coins + :amount >= 0`` in the same transaction as its ``CoinLedger`` row,
+so concurrent requests can neither lose an update nor overdraw. Handlers issue
+the write first in their transaction, which makes SQLite take the write lock up
+front instead of failing a read-to-write upgrade.
+
+``CoinBalanceSnapshot`` rows, written every ``COIN_SNAPSHOT_INTERVAL`` seconds,
+let ``balance_at`` sum only the entries after the latest snapshot.
+"""
+import asyncio
+import os
+import traceback
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import func, text, update
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+from app.db import engine
+from app.models import CoinBalanceSnapshot, CoinLedger, User
+
+COIN_TREASURY_USERNAME = os.environ.get("COIN_TREASURY_USERNAME", "meadminBoss")
+COIN_SNAPSHOT_INTERVAL = float(os.environ.get("COIN_SNAPSHOT_INTERVAL", 3600))
+
+
+def apply(session: Session, user_id: int, amount: int, reason: str, ref_id: Optional[int] = None) -> Optional[int]:
+    """Add ``amount`` (may be negative) to a balance and record it.
+
+    Returns the new balance, or None when the user doesn't exist or the
+    balance would go below zero. Nothing is committed here.
+    """
+    balance = session.execute(
+        update(User)
+        .where(User.id == user_id, User.coins + amount >= 0)
+        .values(coins=User.coins + amount)
+        .returning(User.coins)
+    ).scalar()
+    if balance is None:
+        return None
+    session.add(CoinLedger(user_id=user_id, amount=amount, reason=reason, ref_id=ref_id))
+    return balance
+
+
+def treasury(session: Session) -> Optional[User]:
+    """The account that receives order payments."""
+    return session.exec(select(User).where(User.username == COIN_TREASURY_USERNAME)).first()
+
+
+def balance_at(session: Session, user_id: int, at: datetime) -> int:
+    """Balance right after the last ledger entry at or before ``at``."""
+    snapshot = session.exec(
+        select(CoinBalanceSnapshot)
+        .where(CoinBalanceSnapshot.user_id == user_id, CoinBalanceSnapshot.as_of <= at)
+        .order_by(CoinBalanceSnapshot.ledger_id.desc())
+        .limit(1)
+    ).first()
+    start, after_id = (snapshot.balance, snapshot.ledger_id) if snapshot else (0, 0)
+    delta = session.exec(
+        select(func.coalesce(func.sum(CoinLedger.amount), 0))
+        .where(CoinLedger.user_id == user_id, CoinLedger.id > after_id, CoinLedger.created_at <= at)
+    ).one()
+    return start + delta
+
+
+# -----------------------------
+# Snapshots and checks
+# -----------------------------
+def take_snapshots(bind=engine) -> int:
+    """Snapshot every user with ledger entries since their last snapshot."""
+    with bind.begin() as conn:
+        return conn.execute(text(
+            "INSERT INTO coinbalancesnapshot (user_id, ledger_id, balance, as_of) "
+            "SELECT g.user_id, g.ledger_id, g.balance, last.created_at FROM ("
+            "SELECT l.user_id, MAX(l.id) AS ledger_id, COALESCE(s.balance, 0) + SUM(l.amount) AS balance "
+            "FROM coinledger l LEFT JOIN coinbalancesnapshot s ON s.user_id = l.user_id "
+            "AND s.ledger_id = (SELECT MAX(ledger_id) FROM coinbalancesnapshot WHERE user_id = l.user_id) "
+            "WHERE l.id > COALESCE(s.ledger_id, 0) "
+            "GROUP BY l.user_id) g JOIN coinledger last ON last.id = g.ledger_id"
+        )).rowcount
+
+
+def drift(bind=engine) -> list:
+    """Users whose balance differs from their ledger sum (should be empty)."""
+    with bind.connect() as conn:
+        rows = conn.execute(text(
+            'SELECT u.id, u.coins, COALESCE(SUM(l.amount), 0) AS ledger FROM "user" u '
+            "LEFT JOIN coinledger l ON l.user_id = u.id GROUP BY u.id "
+            "HAVING u.coins != COALESCE(SUM(l.amount), 0)"
+        )).all()
+    return [{"user_id": r.id, "coins": r.coins, "ledger": r.ledger} for r in rows]
+
+
+def record_opening_balances(conn) -> int:
+    """One "opening" entry per user whose coins predate the ledger. Used by migration 8."""
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+    return conn.execute(text(
+        "INSERT INTO coinledger (user_id, amount, reason, created_at) "
+        "SELECT u.id, u.coins - COALESCE((SELECT SUM(amount) FROM coinledger WHERE user_id = u.id), 0), "
+        "'opening', :now FROM \"user\" u "
+        "WHERE u.coins != COALESCE((SELECT SUM(amount) FROM coinledger WHERE user_id = u.id), 0)"
+    ), {"now": now}).rowcount
+
+
+async def run_snapshots():
+    """Background loop started by main.on_startup."""
+    while True:
+        await asyncio.sleep(COIN_SNAPSHOT_INTERVAL)
+        try:
+            await run_in_threadpool(take_snapshots)
+        except Exception:
+            traceback.print_exc()
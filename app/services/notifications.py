@@ -4,20 +4,20 @@ from pydantic import BaseModel
 from datetime import datetime
 import json
 import os
-import requests 
+from app.services.push import dispatcher
+from app.services.kv import kv, NO_EXPIRY
 
 app = FastAPI()
 router = APIRouter(prefix="/notifications", tags=["Notifications"])
 
-FIREBASE_SERVER_KEY = os.getenv("FIREBASE_SERVER_KEY")
-FCM_URL = "https://fcm.googleapis.com/fcm/send"
-
-user_tokens: Dict[int, str] = {}  
+# Shared store keys:
+#   push_token:<user_id>:<token> -> 1       (one key per device)
+#   push_owner:<token>           -> user_id (for pruning)
+#   notif_order:<order_id>       -> order dict
+PUSH_TOKEN_TTL = float(os.getenv("PUSH_TOKEN_TTL", 60 * 24 * 3600))  # apps re-save tokens on launch
+NOTIF_ORDER_TTL = float(os.getenv("NOTIF_ORDER_TTL", 30 * 24 * 3600))
 admins = [1, 2]  
 
-orders: Dict[int, Dict] = {}
-order_counter = 1
-
 class Order(BaseModel):
     user_id: int
     name: str
@@ -32,36 +32,31 @@ class ApproveBody(BaseModel):
     delivery_time: Optional[int] = None  # Minutes
 
 # =====================================================
-# Helper: Send Push Notification (updated to use requests)
+# Helper: Send Push Notification (queued, returns a delivery id)
 # =====================================================
-def send_push_notification(token: str, title: str, body: str, data: Optional[Dict] = None):
-    payload = {
-        "to": token,
-        "notification": {
-            "title": title,
-            "body": body,
-            "sound": "default"
-        },
-        "priority": "high",
-        "data": data or {}
-    }
+def send_push_notification(token: str, title: str, body: str, data: Optional[Dict] = None) -> str:
+    return dispatcher.send(token, title, body, data=data)
+
+
+def user_tokens(user_id) -> List[str]:
+    prefix = f"push_token:{user_id}:"
+    return [key[len(prefix):] for key, _ in kv.scan(prefix)]
+
+
+def prune_tokens(tokens: List[str]):
+    """Forget device tokens FCM rejected as unregistered/invalid."""
+    for token in tokens:
+        user_id = kv.get(f"push_owner:{token}")
+        kv.delete(f"push_owner:{token}")
+        if user_id is not None:
+            kv.delete(f"push_token:{user_id}:{token}")
+
+
+def all_orders() -> List[Dict]:
+    return [order for _, order in kv.scan("notif_order:")]
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"key={FIREBASE_SERVER_KEY}"
-    }
 
-    try:
-        response = requests.post(FCM_URL, json=payload, headers=headers)
-        return {
-            "status_code": response.status_code,
-            "response": response.text
-        }
-    except Exception as e:
-        return {
-            "status_code": 500,
-            "response": str(e)
-        }
+dispatcher.on_invalid_tokens = prune_tokens
 
 # =====================================================
 # Save Token
@@ -74,20 +69,18 @@ def save_token(body: Dict = Body(...)):
     if not user_id or not token:
         raise HTTPException(status_code=400, detail="user_id and token required")
 
-    user_tokens[user_id] = token
+    kv.set(f"push_token:{user_id}:{token}", 1, ttl=PUSH_TOKEN_TTL)
+    kv.set(f"push_owner:{token}", user_id, ttl=PUSH_TOKEN_TTL)
     return {"success": True, "message": "Token saved"}
 
 # =====================================================
 # User Finishes Order
 # =====================================================
 @router.post("/order_finish")
-def order_finish(order: Order):
-    global order_counter
+async def order_finish(order: Order):
+    order_id = kv.incr("notif_order_counter", ttl=NO_EXPIRY)
 
-    order_id = order_counter
-    order_counter += 1
-
-    orders[order_id] = {
+    kv.set(f"notif_order:{order_id}", {
         "order_id": order_id,
         "user_id": order.user_id,
         "name": order.name,
@@ -98,35 +91,36 @@ def order_finish(order: Order):
         "status": "pending",
         "delivery_time": None,
         "created_at": datetime.utcnow().isoformat()
-    }
+    }, ttl=NOTIF_ORDER_TTL)
 
     # Notify admins
     title = "🛍️ New Order Received"
     body_text = f"{order.name} placed an order totaling {order.total_price} UZS"
 
-    results = []
-    for admin_id in admins:
-        token = user_tokens.get(admin_id)
-        if token:
-            res = send_push_notification(
-                token,
-                title,
-                body_text,
-                data={"type": "order", "order_id": order_id}
-            )
-            results.append({"admin_id": admin_id, "result": res})
-
-    return {"success": True, "order_id": order_id, "admin_notifications": results}
+    # One multicast fan-out for every admin device
+    tokens = [token for admin_id in admins for token in user_tokens(admin_id)]
+    delivery_ids = dispatcher.fan_out(
+        tokens,
+        title,
+        body_text,
+        data={"type": "order", "order_id": order_id}
+    )
+
+    return {
+        "success": True,
+        "order_id": order_id,
+        "admin_notifications": {"devices": len(tokens), "delivery_ids": delivery_ids},
+    }
 
 # =====================================================
 # Admin Approves or Denies Order
 # =====================================================
 @router.post("/approve_order")
-def approve_order(body: ApproveBody):
-    if body.order_id not in orders:
+async def approve_order(body: ApproveBody):
+    order = kv.get(f"notif_order:{body.order_id}")
+    if order is None:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    order = orders[body.order_id]
     user_id = order["user_id"]
 
     if body.approve:
@@ -143,35 +137,34 @@ def approve_order(body: ApproveBody):
         title = "❌ Order Denied"
         message = "Your order has been denied"
         data = {"type": "denied", "order_id": body.order_id}
+    kv.set(f"notif_order:{body.order_id}", order, ttl=NOTIF_ORDER_TTL)
 
-    token = user_tokens.get(user_id)
-    result = None
-    if token:
-        result = send_push_notification(token, title, message, data=data)
-    else:
+    tokens = user_tokens(user_id)
+    if not tokens:
         raise HTTPException(status_code=404, detail="User FCM token not found")
+    delivery_ids = dispatcher.fan_out(tokens, title, message, data=data)
 
-    return {"success": True, "order": order, "fcm_result": result}
+    return {"success": True, "order": order, "delivery_ids": delivery_ids}
 
 # =====================================================
 # Admin: View All Pending Orders
 # =====================================================
 @router.get("/admin_orders")
 def admin_orders():
-    return {"success": True, "pending_orders": [o for o in orders.values() if o["status"] == "pending"]}
+    return {"success": True, "pending_orders": [o for o in all_orders() if o["status"] == "pending"]}
 
 # =====================================================
 # User: View All Their Orders
 # =====================================================
 @router.get("/user_orders/{user_id}")
 def user_orders(user_id: int):
-    return {"success": True, "orders": [o for o in orders.values() if o["user_id"] == user_id]}
+    return {"success": True, "orders": [o for o in all_orders() if o["user_id"] == user_id]}
 
 # =====================================================
 # Send Notification to Any User (optional utility)
 # =====================================================
 @router.post("/send_to_user")
-def send_to_user(body: Dict = Body(...)):
+async def send_to_user(body: Dict = Body(...)):
     user_id = body.get("user_id")
     title = body.get("title")
     message = body.get("message")
@@ -179,11 +172,21 @@ def send_to_user(body: Dict = Body(...)):
     if not all([user_id, title, message]):
         raise HTTPException(status_code=400, detail="user_id, title, message required")
 
-    token = user_tokens.get(user_id)
-    if not token:
+    tokens = user_tokens(user_id)
+    if not tokens:
         raise HTTPException(status_code=404, detail="FCM token not found")
 
-    result = send_push_notification(token, title, message)
-    return {"success": True, "result": result}
+    delivery_ids = dispatcher.fan_out(tokens, title, message)
+    return {"success": True, "delivery_ids": delivery_ids}
+
+# =====================================================
+# Delivery status for a queued push
+# =====================================================
+@router.get("/deliveries/{delivery_id}")
+def delivery_status(delivery_id: str):
+    result = dispatcher.status(delivery_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Delivery not found")
+    return {"delivery_id": delivery_id, **result}
 
 app.include_router(router)
\ No newline at end of file
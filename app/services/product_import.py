@@ -0,0 +1,145 @@
+"""Bulk product import from CSV or JSON Lines.
+
+Rows are parsed one at a time from the (spooled) upload and inserted in
+batches of ``batch_size``, each batch in its own transaction, so memory does
+not grow with the file. Store ids are loaded once up front. Images come from
+an optional zip: a row's ``image`` names a member, which is streamed through
+the same content-addressed storage as regular uploads.
+
+Columns: title_in_uzb, title_in_rus, title_in_eng, price, store_id
+(required), description_in_uzb/rus/eng and image (optional).
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+from datetime import datetime
+from typing import IO, Iterator, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import insert
+from sqlmodel import Session, select
+from app.models import Product, Store
+from app.services.storage import store_stream
+
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 500))
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", 100))  # reported, not a limit on failures
+
+REQUIRED = ("title_in_uzb", "title_in_rus", "title_in_eng", "price", "store_id")
+OPTIONAL = ("description_in_uzb", "description_in_rus", "description_in_eng")
+
+
+def iter_rows(fileobj: IO[bytes], fmt: str) -> Iterator[Tuple[int, dict]]:
+    """Yield ``(line_number, row)``; a JSON line that fails to parse yields its error instead."""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_num, ValueError(f"invalid JSON: {e}")
+                continue
+            yield line_num, row if isinstance(row, dict) else ValueError("expected a JSON object")
+
+
+def parse_row(row: dict, store_ids: set, now: datetime) -> dict:
+    """Validate one row into Product column values; raises ValueError."""
+    missing = [f for f in REQUIRED if row.get(f) is None or not str(row[f]).strip()]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    try:
+        price = int(row["price"])
+        store_id = int(row["store_id"])
+    except (TypeError, ValueError):
+        raise ValueError("price and store_id must be integers")
+    if price < 0:
+        raise ValueError("price must not be negative")
+    if store_id not in store_ids:
+        raise ValueError(f"store {store_id} not found")
+    values = {f: str(row[f]).strip() for f in REQUIRED[:3]}
+    values.update({f: (str(row[f]).strip() or None) if row.get(f) is not None else None for f in OPTIONAL})
+    values.update(price=price, store_id=store_id, image_path=None, created_at=now)
+    return values
+
+
+def import_products(
+    session: Session,
+    fileobj: IO[bytes],
+    fmt: str,
+    images: Optional[IO[bytes]] = None,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> Tuple[dict, set]:
+    """Import every valid row; returns ``(report, stored image paths)``."""
+    store_ids = set(session.exec(select(Store.id)).all())
+    archive = None
+    if images is not None:
+        try:
+            archive = zipfile.ZipFile(images)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="images must be a zip archive")
+
+    inserted = failed = 0
+    errors = []
+    stores_touched = set()
+    image_paths = set()
+    batch = []
+
+    def flush():
+        nonlocal inserted
+        if batch:
+            session.execute(insert(Product), batch)
+            session.commit()
+            inserted += len(batch)
+            batch.clear()
+
+    try:
+        for line, row in iter_rows(fileobj, fmt):
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                values = parse_row(row, store_ids, datetime.utcnow())
+                name = str(row.get("image") or "").strip()
+                if name:
+                    if archive is None:
+                        raise ValueError("image given but no images zip uploaded")
+                    try:
+                        with archive.open(name) as member:
+                            values["image_path"] = store_stream(member)
+                    except KeyError:
+                        raise ValueError(f"image {name} not in zip")
+                    except HTTPException as e:
+                        raise ValueError(f"image {name}: {e.detail}")
+                    image_paths.add(values["image_path"])
+            except ValueError as e:
+                failed += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({"line": line, "error": str(e)})
+                continue
+
+            batch.append(values)
+            stores_touched.add(values["store_id"])
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    except (UnicodeDecodeError, csv.Error) as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=f"Unreadable file after {inserted} rows: {e}")
+    finally:
+        if archive is not None:
+            archive.close()
+
+    report = {
+        "inserted": inserted,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors),
+        "stores": sorted(stores_touched),
+        "images": len(image_paths),
+    }
+    return report, image_paths
@@ -0,0 +1,172 @@
+"""Non-blocking FCM push delivery.
+
+Handlers call ``dispatcher.send(...)``, which only puts the message on a
+bounded in-memory queue and returns a delivery id. ``PUSH_WORKERS`` background
+tasks drain the queue over one pooled HTTP client, with per-request timeouts
+and exponential backoff (with jitter) on timeouts, 429 and 5xx responses.
+Point ``FCM_URL`` at a local fake server to exercise it end to end.
+
+Fan-out to many devices goes through ``fan_out``: tokens are packed into
+multicast requests of up to ``FCM_MULTICAST_LIMIT`` (``registration_ids``),
+which the workers send concurrently. Tokens FCM reports as unregistered or
+invalid are passed to ``on_invalid_tokens`` so the registry can drop them.
+"""
+import asyncio
+import os
+import random
+import traceback
+from typing import Callable, Dict, Iterable, List, Optional
+from uuid import uuid4
+import httpx
+from fastapi import HTTPException, status
+from app.cache import TTLCache
+
+FIREBASE_SERVER_KEY = os.getenv("FIREBASE_SERVER_KEY")
+FCM_URL = os.getenv("FCM_URL", "https://fcm.googleapis.com/fcm/send")
+
+PUSH_WORKERS = int(os.getenv("PUSH_WORKERS", 4))
+PUSH_QUEUE_SIZE = int(os.getenv("PUSH_QUEUE_SIZE", 1000))
+PUSH_TIMEOUT = float(os.getenv("PUSH_TIMEOUT", 5))
+PUSH_MAX_ATTEMPTS = int(os.getenv("PUSH_MAX_ATTEMPTS", 4))
+PUSH_BACKOFF = float(os.getenv("PUSH_BACKOFF", 0.5))  # seconds before the first retry
+PUSH_MAX_CONNECTIONS = int(os.getenv("PUSH_MAX_CONNECTIONS", 20))
+FCM_MULTICAST_LIMIT = int(os.getenv("FCM_MULTICAST_LIMIT", 1000))  # FCM's registration_ids cap
+
+# Per-token errors after which a token will never work again
+INVALID_TOKEN_ERRORS = {"NotRegistered", "InvalidRegistration"}
+
+
+def build_payload(token, title: str, body: str, data: Optional[Dict] = None) -> dict:
+    """FCM payload for one token, or a multicast one for a list of tokens."""
+    target = {"registration_ids": list(token)} if isinstance(token, (list, tuple)) else {"to": token}
+    return {
+        **target,
+        "notification": {
+            "title": title,
+            "body": body,
+            "sound": "default"
+        },
+        "priority": "high",
+        "data": data or {}
+    }
+
+
+class PushDispatcher:
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self._workers = []
+        # delivery id -> {"status", "attempts", ...}; bounded so it can't grow forever
+        self.deliveries = TTLCache(maxsize=10000, ttl=3600)
+        # Called with the tokens FCM rejected permanently
+        self.on_invalid_tokens: Optional[Callable[[List[str]], None]] = None
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=PUSH_QUEUE_SIZE)
+        self.client = httpx.AsyncClient(
+            timeout=PUSH_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=PUSH_MAX_CONNECTIONS,
+                max_keepalive_connections=PUSH_MAX_CONNECTIONS,
+            ),
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"key={FIREBASE_SERVER_KEY}"
+            },
+        )
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(PUSH_WORKERS)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def enqueue(self, payload: dict) -> str:
+        """Queue a raw FCM payload; must be called from the event loop thread."""
+        if self.queue is None:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Push dispatcher not running")
+        delivery_id = uuid4().hex
+        try:
+            self.queue.put_nowait((delivery_id, payload))
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Push queue is full",
+                headers={"Retry-After": "1"},
+            )
+        self.deliveries.set(delivery_id, {"status": "queued", "attempts": 0})
+        return delivery_id
+
+    def send(self, token: str, title: str, body: str, data: Optional[Dict] = None) -> str:
+        return self.enqueue(build_payload(token, title, body, data))
+
+    def fan_out(self, tokens: Iterable[str], title: str, body: str, data: Optional[Dict] = None) -> List[str]:
+        """Send one notification to many devices in multicast batches."""
+        tokens = list(dict.fromkeys(tokens))  # dedupe, keep order
+        return [
+            self.enqueue(build_payload(tokens[i:i + FCM_MULTICAST_LIMIT], title, body, data))
+            for i in range(0, len(tokens), FCM_MULTICAST_LIMIT)
+        ]
+
+    def status(self, delivery_id: str) -> Optional[dict]:
+        return self.deliveries.get(delivery_id)
+
+    async def _worker(self):
+        while True:
+            delivery_id, payload = await self.queue.get()
+            try:
+                await self._deliver(delivery_id, payload)
+            except Exception:
+                traceback.print_exc()
+                self.deliveries.set(delivery_id, {"status": "failed", "error": "internal error"})
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, delivery_id: str, payload: dict):
+        error = None
+        for attempt in range(1, PUSH_MAX_ATTEMPTS + 1):
+            try:
+                response = await self.client.post(FCM_URL, json=payload)
+                if response.status_code < 500 and response.status_code != 429:
+                    if response.is_success:
+                        self._prune_invalid(payload, response)
+                    self.deliveries.set(delivery_id, {
+                        "status": "sent" if response.is_success else "failed",
+                        "attempts": attempt,
+                        "status_code": response.status_code,
+                        "response": response.text[:1000],
+                    })
+                    return response
+                error = f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+
+            self.deliveries.set(delivery_id, {"status": "retrying", "attempts": attempt, "error": error})
+            if attempt < PUSH_MAX_ATTEMPTS:
+                await asyncio.sleep(PUSH_BACKOFF * 2 ** (attempt - 1) * (1 + random.random()))
+
+        self.deliveries.set(delivery_id, {"status": "failed", "attempts": PUSH_MAX_ATTEMPTS, "error": error})
+        return None
+
+    def _prune_invalid(self, payload: dict, response: httpx.Response):
+        """FCM returns one result per token, in request order."""
+        if self.on_invalid_tokens is None:
+            return
+        tokens = payload.get("registration_ids") or [payload.get("to")]
+        try:
+            results = response.json().get("results") or []
+        except ValueError:
+            return
+        invalid = [
+            token for token, result in zip(tokens, results)
+            if result.get("error") in INVALID_TOKEN_ERRORS
+        ]
+        if invalid:
+            self.on_invalid_tokens(invalid)
+
+
+dispatcher = PushDispatcher()
@@ -0,0 +1,187 @@
+"""Content-addressed upload storage.
+
+Uploads are stored once per distinct content as
+``uploads/<h[0:2]>/<h[2:4]>/<sha256>.<ext>``: identical files deduplicate for
+free and the two-level sharding keeps every directory small (~15 entries per
+directory at a million files). That relative path is the one canonical value
+kept in ``Product.image_path`` / ``CoinRequest.image_path``.
+
+``python -m app.services.storage --prune-legacy`` deletes the flat pre-sharding
+files once migration 4 has moved every row over to blobs.
+"""
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import text
+from app.db import UPLOAD_DIR
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+
+BLOB_RE = re.compile(r"^uploads/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(_w\d+)?\.\w+$")
+
+
+def canonical(rel_path: str) -> str:
+    """Normalize legacy spellings (``./uploads/``, ``uploads/uploads/``, bare names)."""
+    rel = rel_path.replace("\\", "/")
+    while rel.startswith("./"):
+        rel = rel[2:]
+    while rel.startswith("uploads/"):
+        rel = rel[len("uploads/"):]
+    return f"uploads/{rel}"
+
+
+def local_path(rel_path: str) -> str:
+    """Map a stored ``uploads/...`` path to the file under UPLOAD_DIR."""
+    return os.path.join(UPLOAD_DIR, canonical(rel_path)[len("uploads/"):])
+
+
+def public_url(rel_path: str, base_url: str) -> str:
+    return f"{base_url.rstrip('/')}/{canonical(rel_path)}"
+
+
+def blob_path(digest: str, ext: str) -> str:
+    return f"uploads/{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+def is_blob(rel_path: str) -> bool:
+    return bool(BLOB_RE.match(canonical(rel_path)))
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Extension for the image format in ``head`` (magic bytes), else None."""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    return None
+
+
+def stream_to_temp(fileobj, upload_dir: str = UPLOAD_DIR):
+    """Copy an upload to a temp file in fixed-size chunks.
+
+    Enforces MAX_UPLOAD_BYTES and the image type while streaming and hashes as
+    it goes, so memory stays at one chunk whatever the upload size.
+    Returns ``(tmp_path, sha256_hex, size, extension)``.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix=".tmp")
+    digest = hashlib.sha256()
+    size = 0
+    ext = None
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := fileobj.read(UPLOAD_CHUNK_SIZE):
+                if ext is None:
+                    ext = sniff_image_type(chunk)
+                    if ext is None:
+                        raise HTTPException(status_code=415, detail="Unsupported file type, expected an image")
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"File too large (max {MAX_UPLOAD_BYTES} bytes)")
+                digest.update(chunk)
+                out.write(chunk)
+        if ext is None:
+            raise HTTPException(status_code=400, detail="Empty upload")
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return tmp_path, digest.hexdigest(), size, ext
+
+
+def commit_blob(tmp_path: str, digest: str, ext: str) -> str:
+    """Atomically move a hashed temp file to its blob path (or drop it if known)."""
+    rel = blob_path(digest, ext)
+    final = local_path(rel)
+    if os.path.exists(final):
+        os.unlink(tmp_path)  # same content already stored
+    else:
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        os.replace(tmp_path, final)
+    return rel
+
+
+def store_stream(fileobj) -> str:
+    """Store a file-like object; returns its canonical relative path."""
+    tmp_path, digest, _, ext = stream_to_temp(fileobj, UPLOAD_DIR)
+    return commit_blob(tmp_path, digest, ext)
+
+
+# -----------------------------
+# Legacy flat uploads
+# -----------------------------
+def ingest_file(src: str) -> str:
+    """Add an existing file as a blob (hard link when possible), keeping ``src``."""
+    digest = hashlib.sha256()
+    head = b""
+    with open(src, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            head = head or chunk[:16]
+            digest.update(chunk)
+    ext = sniff_image_type(head) or os.path.splitext(src)[1].lstrip(".").lower() or "bin"
+    rel = blob_path(digest.hexdigest(), ext)
+    final = local_path(rel)
+    if not os.path.exists(final):
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        tmp = f"{final}.tmp"
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copy2(src, tmp)
+        os.replace(tmp, final)
+    return rel
+
+
+def migrate_legacy_rows(conn) -> int:
+    """Point every legacy image path at its blob. Used by migration 4."""
+    blobs = {}  # legacy file name -> blob path
+    updated = 0
+    for table, column in (("product", "image_path"), ("coinrequest", "image_path"), ("store", "store_photo")):
+        rows = conn.execute(text(
+            f'SELECT id, {column} FROM "{table}" WHERE {column} IS NOT NULL'
+        )).all()
+        for row_id, path in rows:
+            if is_blob(path):
+                continue
+            name = os.path.basename(path.replace("\\", "/"))
+            if name not in blobs:
+                src = os.path.join(UPLOAD_DIR, name)
+                if not os.path.isfile(src):
+                    continue  # missing file or an external URL; leave as-is
+                blobs[name] = ingest_file(src)
+            conn.execute(
+                text(f'UPDATE "{table}" SET {column} = :path WHERE id = :id'),
+                {"path": blobs[name], "id": row_id},
+            )
+            updated += 1
+    return updated
+
+
+def prune_legacy() -> int:
+    """Delete flat files left in UPLOAD_DIR's top level after migration 4."""
+    removed = 0
+    for entry in os.scandir(UPLOAD_DIR):
+        if entry.is_file():
+            os.unlink(entry.path)
+            removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    if "--prune-legacy" in sys.argv:
+        from app.db import engine
+
+        with engine.connect() as conn:
+            done = conn.execute(text("SELECT 1 FROM schema_migrations WHERE version = 4")).first()
+        if not done:
+            sys.exit("Migration 4 has not run yet; start the app or run python -m app.migrate first")
+        print(f"🧹 Removed {prune_legacy()} legacy files")
@@ -2,32 +2,59 @@ import os
 import shutil
 from datetime import datetime
 from app.db import UPLOAD_DIR
+from app.models import Product
+from app.services.storage import public_url, store_stream
+from app.services.images import variant_urls
 from fastapi import Request, UploadFile
 from uuid import uuid4
 
 
-def save_upload_uploadfile(upload_file: UploadFile, upload_dir: str) -> str:
-    os.makedirs(upload_dir, exist_ok=True)
-    filename = f"{uuid4().int}_{datetime.now().strftime('%Y-%m-%d')}_{upload_file.filename}"
-    file_path = os.path.join(upload_dir, filename)
+def save_upload_uploadfile(upload_file: UploadFile) -> str:
+    """Store an upload content-addressed; returns its canonical ``uploads/...`` path."""
+    return store_stream(upload_file.file)
 
-    # Save the file
-    with open(file_path, "wb") as f:
-        f.write(upload_file.file.read())
 
-    # ✅ Return only the *relative* path (no "./")
-    return f"uploads/{filename}"
+# Title/description columns per User.language (0 - Uzbek, 1 - Russian, 2 - English)
+PRODUCT_LANGUAGE_COLUMNS = {
+    0: (Product.title_in_uzb, Product.description_in_uzb),
+    1: (Product.title_in_rus, Product.description_in_rus),
+    2: (Product.title_in_eng, Product.description_in_eng),
+}
 
 
-def product_to_dict(product, request: Request):
+def product_columns(language: int) -> tuple:
+    """Columns to select for a product as seen in ``language``.
+
+    Selecting these instead of ``Product`` reads one title/description pair
+    rather than all six and yields plain rows instead of ORM instances.
+    """
+    title, description = PRODUCT_LANGUAGE_COLUMNS.get(language, PRODUCT_LANGUAGE_COLUMNS[2])
+    return (
+        Product.id,
+        title.label("title"),
+        description.label("description"),
+        Product.price,
+        Product.store_id,
+        Product.image_path,
+        Product.created_at,
+    )
+
+
+def product_to_dict(row, base_url: str) -> dict:
+    """Serialize a row selected with ``product_columns``."""
+    image_url = None
+    image_variants = {}
+    if row.image_path:
+        image_url = public_url(row.image_path, base_url)
+        image_variants = variant_urls(row.image_path, base_url)
     return {
-        "id": product.id,
-        "title": product.title,
-        "description": product.description,
-        "price": product.price,
-        "store_id": product.store_id,
-        "created_at": product.created_at,
-        "image_path": str(request.url_for("uploads", path=os.path.basename(product.image_path)))
+        "id": row.id,
+        "title": row.title,
+        "description": row.description,
+        "price": row.price,
+        "store_id": row.store_id,
+        "image_url": image_url,
+        "image_variants": image_variants,
     }
 
     
\ No newline at end of file